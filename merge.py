@@ -1,11 +1,52 @@
 import os
 import re
-from pathlib import Path
+import hashlib
+import json
+import fnmatch
+import pickle
+import sqlite3
+import zlib
+import zipfile
+import unicodedata
+import statistics
+from bisect import bisect_right
 import time
-from datetime import datetime
+from datetime import datetime, date, time as dt_time, timedelta
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook, Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.reader.strings import read_string_table
+from openpyxl.packaging.manifest import Manifest
+from openpyxl.packaging.workbook import WorkbookPackage
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH
+from openpyxl.xml.constants import ARC_CONTENT_TYPES, ARC_STYLE, SHARED_STRINGS, SHEET_MAIN_NS
+from openpyxl.xml.functions import fromstring
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.cell import Cell, MergedCell, WriteOnlyCell
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.worksheet.merge import MergedCellRange
+from openpyxl.compat import safe_string
+from openpyxl.utils.datetime import from_excel, to_excel
+from pandas.io.parsers import TextParser
 from copy import copy
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+try:
+    # 軽量な読み込みとサイドカーは openpyxl の内部 API を使う（requirements.txt で動作を確認した版に固定している）。
+    # 内部 API が無い版では LIGHT_READER_AVAILABLE を False にし、load_workbook / pd.read_excel で読む
+    from openpyxl.worksheet._reader import WorkSheetParser, FORMULA_TAG, _cast_number
+    from openpyxl.reader.excel import _find_workbook_part
+    LIGHT_READER_AVAILABLE = True
+except ImportError:
+    WorkSheetParser = object
+    FORMULA_TAG = _cast_number = _find_workbook_part = None
+    LIGHT_READER_AVAILABLE = False
 
 # ===== 定数設定 =====
 # 環境変数がなければデフォルト値を利用
@@ -27,233 +68,1861 @@ PHASE3_OUTPUT_DIR = os.path.join(
 )
 LOG_FILE_PATH = os.path.join(PHASE1_OUTPUT_DIR, "execution_log.txt")
 
+# Phase1 のワークブック読み込みに使うプロセス数（1 の場合は逐次処理）
+PHASE1_WORKERS = int(os.getenv('PHASE1_WORKERS', '1'))
+# Phase1 の読み込み方式（full: 従来どおり全体を読み込む / stream: read_only で行を順に読む）
+PHASE1_SCAN_MODE = os.getenv('PHASE1_SCAN_MODE', 'full')
+# 企業フォルダの一覧取得に使うスレッド数
+DISCOVERY_WORKERS = int(os.getenv('DISCOVERY_WORKERS', '8'))
+# 前回実行のマニフェストを使い、変更のないファイルの読み込みを省略する（0 で無効）
+PHASE1_INCREMENTAL = os.getenv('PHASE1_INCREMENTAL', '1') != '0'
+# 前回の Phase2 の入力・出力の指紋を使い、パターン一覧に変更がなければ書き込みを省略する（0 で無効）
+PHASE2_INCREMENTAL = os.getenv('PHASE2_INCREMENTAL', '1') != '0'
+# 1 の場合、Phase3 の転置ブックを write-only のブックへ1ファイル分ずつ書き出し、メモリ使用量を一定に保つ
+# （この場合 Phase3 の出力にはサイドカーを書かない）
+PHASE3_STREAMING_WRITE = os.getenv('PHASE3_STREAMING_WRITE', '0') == '1'
+# 1 の場合、Phase3 は値と結合範囲だけを転置する（スタイルを読まず・写さない。0 でスタイル付きの転置）
+# 未設定の場合、main() から Phase4 と続けて実行するときだけ有効になる
+PHASE3_VALUES_ONLY = os.getenv('PHASE3_VALUES_ONLY', '')
+# Phase3 でパターンごとの転置ブックを並列に作るプロセス数（1 の場合は逐次処理）
+PHASE3_WORKERS = int(os.getenv('PHASE3_WORKERS', '1'))
+# Phase3 で元ファイルを読む上限（1秒あたりのファイル数、0 で上限なし）
+PHASE3_IO_RATE = float(os.getenv('PHASE3_IO_RATE', '0'))
+# 読み込みの失敗や所要時間の急増があったときに入れる待ち時間の上限（秒）
+PHASE3_THROTTLE_MAX_SECONDS = float(os.getenv('PHASE3_THROTTLE_MAX_SECONDS', '30'))
+# 直近の平均の何倍を超えたら所要時間の急増とみなすか
+PHASE3_LATENCY_SPIKE_FACTOR = float(os.getenv('PHASE3_LATENCY_SPIKE_FACTOR', '3'))
+
+# 実行ログはこの行数または秒数ごとにまとめて書き込む
+LOG_FLUSH_LINES = int(os.getenv('LOG_FLUSH_LINES', '200'))
+LOG_FLUSH_SECONDS = float(os.getenv('LOG_FLUSH_SECONDS', '10'))
+# 1 の場合、ファイルごとの処理時間などを execution_log.jsonl にも出力する
+RUN_LOG_JSONL = os.getenv('RUN_LOG_JSONL', '0') == '1'
+
+# 1 の場合、解析済みシートをキャッシュする（ブックの指紋をキーに Phase1/Phase3 で共有、既定は無効）
+SHEET_CACHE_ENABLED = os.getenv('SHEET_CACHE', '0') == '1'
+SHEET_CACHE_DIR = os.getenv('SHEET_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'product-sheet-merge', 'sheets'))
+SHEET_CACHE_MAX_MB = int(os.getenv('SHEET_CACHE_MAX_MB', '2048'))
+
+# 1 の場合、値だけを使う読み込み（Phase1・Phase4・Phase5）を load_workbook を通さない軽量な読み込みにする
+LIGHT_XLSX_LOADER = os.getenv('LIGHT_XLSX_LOADER', '0') == '1'
+
+# 各フェーズの出力 xlsx と一緒に、次のフェーズが xlsx を読まずに済むサイドカーを書く（0 で無効）
+PHASE_SIDECARS = os.getenv('PHASE_SIDECARS', '1') != '0'
+
+# 1 の場合、自治体をまたいで共有するパターンカタログ（SQLite）に記録する（既定は無効）
+# 記録した対応は Phase1 のログとパターン別ファイル数の列に出すだけで、Phase2 の集計には使わない
+# SQLite は共有ドライブ上ではロックが不安定なためローカルに置く
+PATTERN_CATALOG_ENABLED = os.getenv('PATTERN_CATALOG', '0') == '1'
+PATTERN_CATALOG_PATH = os.getenv('PATTERN_CATALOG_PATH', os.path.join(os.path.expanduser('~'), '.product-sheet-merge', 'pattern_catalog.sqlite'))
+# 類似パターンのクラスタリングで同じレイアウトとみなす Jaccard 類似度の下限
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.7'))
+# 新しいパターンごとに実行ログへ出す類似の既存パターンの件数（0 で無効）
+SIMILAR_PATTERN_TOP_K = int(os.getenv('SIMILAR_PATTERN_TOP_K', '3'))
+
 # 出力先ディレクトリが存在しなければ作成
 for d in [PHASE1_OUTPUT_DIR, PHASE2_OUTPUT_DIR, PHASE3_OUTPUT_DIR]:
     if not os.path.exists(d):
         os.makedirs(d, exist_ok=True)
 
+# ===== 実行ログ =====
+class RunLogger:
+    """
+    バッファ付きの実行ログ。
+    ログファイルは共有ドライブ上にあり、open/close のたびに往復が発生するため、
+    書き込みをためておき LOG_FLUSH_LINES 行または LOG_FLUSH_SECONDS 秒ごとに
+    まとめて追記する。jsonl_path を指定すると record() の内容を JSON Lines でも出力する。
+    """
+
+    def __init__(self, log_file_path, jsonl_path=None, flush_lines=None, flush_seconds=None):
+        self.log_file_path = log_file_path
+        self.jsonl_path = jsonl_path
+        self.flush_lines = LOG_FLUSH_LINES if flush_lines is None else flush_lines
+        self.flush_seconds = LOG_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self._lines = []
+        self._records = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, text):
+        self._lines.append(text)
+        self._flush_if_due()
+
+    def record(self, event, **fields):
+        """構造化した記録を追加する（jsonl_path 未指定の場合は何もしない）"""
+        if self.jsonl_path is None:
+            return
+        self._records.append({'time': datetime.now().isoformat(), 'event': event, **fields})
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if (len(self._lines) + len(self._records) >= self.flush_lines
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            with open(self.log_file_path, 'a', encoding='utf-8') as log_file:
+                log_file.write("".join(self._lines))
+            self._lines = []
+        if self._records:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as jsonl_file:
+                jsonl_file.writelines(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in self._records)
+            self._records = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+# ===== 解析済みシートのキャッシュ =====
+class GridCell:
+    """SheetGrid のセル。openpyxl のセルと同じ名前で値・位置・スタイルを参照できる"""
+    __slots__ = ('_grid', 'row', 'column', 'value')
+
+    def __init__(self, grid, row, column, value):
+        self._grid = grid
+        self.row = row
+        self.column = column
+        self.value = value
+
+    @property
+    def column_letter(self):
+        return get_column_letter(self.column)
+
+    @property
+    def coordinate(self):
+        return f"{self.column_letter}{self.row}"
+
+    @property
+    def _style_entry(self):
+        return self._grid.style_entry(self.row, self.column)
+
+    @property
+    def has_style(self):
+        return self._style_entry is not None
+
+    @property
+    def style_id(self):
+        """シート内のスタイルの番号（同じ番号のセルはスタイルが同じ）"""
+        return self._grid.style_index(self.row, self.column)
+
+    font = property(lambda self: self._style_entry[0])
+    border = property(lambda self: self._style_entry[1])
+    fill = property(lambda self: self._style_entry[2])
+    number_format = property(lambda self: self._style_entry[3])
+    protection = property(lambda self: self._style_entry[4])
+    alignment = property(lambda self: self._style_entry[5])
+
+class SheetGrid:
+    """
+    アクティブシートの値・結合範囲・（必要なら）スタイルだけを持つ軽量な表現。
+    キャッシュに pickle で保存でき、Phase1/Phase3 が使うワークシートの機能
+    （cell / iter_rows / max_row / max_column / merged_cells）を同じ名前で提供する。
+    """
+
+    def __init__(self, values, max_row, max_column, merged_refs, styles=None, style_ids=None, formulas=None):
+        self.values = values          # 行ごとの値のリスト（1行目から max_row 行目まで）
+        self.max_row = max_row
+        self.max_column = max_column
+        self.merged_refs = merged_refs
+        self.styles = styles          # (font, border, fill, number_format, protection, alignment) のリスト
+        self.style_ids = style_ids    # 行ごとの styles の添字（スタイルなしは -1）
+        self.formulas = formulas      # {(行, 列): 数式}（values は計算結果。read_sheet_source が作る）
+
+    @classmethod
+    def from_worksheet(cls, ws, with_styles=False):
+        values = []
+        styles = [] if with_styles else None
+        style_ids = [] if with_styles else None
+        local_ids = {}
+        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
+            values.append([cell.value for cell in row])
+            if with_styles:
+                row_style_ids = []
+                for cell in row:
+                    if not cell.has_style:
+                        row_style_ids.append(-1)
+                        continue
+                    style_id = cell.style_id
+                    if style_id not in local_ids:
+                        local_ids[style_id] = len(styles)
+                        styles.append((copy(cell.font), copy(cell.border), copy(cell.fill),
+                                       copy(cell.number_format), copy(cell.protection), copy(cell.alignment)))
+                    row_style_ids.append(local_ids[style_id])
+                style_ids.append(row_style_ids)
+        merged_refs = [merged_range.coord for merged_range in ws.merged_cells.ranges]
+        return cls(values, ws.max_row, ws.max_column, merged_refs, styles, style_ids)
+
+    def view(self, data_only=True, with_styles=False):
+        """
+        read_sheet_source で作った SheetGrid から、load_workbook(data_only=data_only) で読んだ場合の
+        SheetGrid を返す。data_only が False なら数式のセルは数式にし、with_styles が False ならスタイルを外す。
+        """
+        values = self.values
+        if not data_only and self.formulas:
+            values = list(values)
+            copied_rows = set()
+            for (row, column), formula in self.formulas.items():
+                if row not in copied_rows:
+                    values[row - 1] = list(values[row - 1])
+                    copied_rows.add(row)
+                values[row - 1][column - 1] = formula
+        if with_styles:
+            return SheetGrid(values, self.max_row, self.max_column, self.merged_refs, self.styles, self.style_ids)
+        return SheetGrid(values, self.max_row, self.max_column, self.merged_refs)
+
+    @property
+    def merged_cells(self):
+        return MultiCellRange(self.merged_refs)
+
+    def _value(self, row, column):
+        if 1 <= row <= len(self.values):
+            row_values = self.values[row - 1]
+            if 1 <= column <= len(row_values):
+                return row_values[column - 1]
+        return None
+
+    def style_index(self, row, column):
+        """styles の添字（スタイルなしは -1）"""
+        if self.style_ids is None or not (1 <= row <= len(self.style_ids)):
+            return -1
+        row_style_ids = self.style_ids[row - 1]
+        if not (1 <= column <= len(row_style_ids)):
+            return -1
+        return row_style_ids[column - 1]
+
+    def style_entry(self, row, column):
+        style_index = self.style_index(row, column)
+        return None if style_index < 0 else self.styles[style_index]
+
+    def cell(self, row, column):
+        return GridCell(self, row, column, self._value(row, column))
+
+    def iter_rows(self, min_row=None, max_row=None, min_col=None, max_col=None, values_only=False):
+        min_row = min_row or 1
+        max_row = max_row or self.max_row
+        min_col = min_col or 1
+        max_col = max_col or self.max_column
+        for row in range(min_row, max_row + 1):
+            if values_only:
+                yield tuple(self._value(row, column) for column in range(min_col, max_col + 1))
+            else:
+                yield tuple(GridCell(self, row, column, self._value(row, column))
+                            for column in range(min_col, max_col + 1))
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+# 値・数式・スタイルに関わるメンバー（ハイパーリンクの参照先はセルの値になるためシートの rels も含め、画像などのメディアは含めない）
+# 値・数式・スタイルに関わるメンバー（画像などのメディアは含めない）
+FINGERPRINT_MEMBER_PATTERN = re.compile(
+    r'^(?:\[Content_Types\]\.xml|xl/workbook\.xml|xl/_rels/workbook\.xml\.rels'
+    r'|xl/styles\.xml|xl/sharedStrings\.xml|xl/worksheets/[^/]+\.xml'
+    r'|xl/worksheets/_rels/[^/]+\.rels)$')
+
+def workbook_fingerprint(file_path):
+    """
+    xlsx の中央ディレクトリに記録された CRC32 とサイズから、シートXML・共有文字列など
+    値に関わるメンバーだけの指紋を作る。中央ディレクトリはファイル末尾にあるため
+    読むのは数KBで済む。zip として開けないファイルは内容全体のハッシュにする。
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            members = sorted((info.filename, info.CRC, info.file_size) for info in archive.infolist()
+                             if FINGERPRINT_MEMBER_PATTERN.match(info.filename))
+    except zipfile.BadZipFile:
+        return file_content_hash(file_path)
+    return hashlib.sha256(json.dumps(members).encode('utf-8')).hexdigest()
+
+class SheetCache:
+    """
+    解析済みシート（SheetGrid）のディスクキャッシュ。
+    ブックの指紋（workbook_fingerprint）と読み込み方法（値のみ／スタイル付き）をキーに、
+    pickle + zlib で保存する。合計サイズが上限を超えたら参照の古いものから削除する（LRU）。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0  # get で見つかったエントリの数
+        self._total_bytes = None
+
+    def _entry_path(self, content_hash, variant):
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}-{variant}.pkl.z")
+
+    def get(self, content_hash, variant):
+        entry_path = self._entry_path(content_hash, variant)
+        try:
+            with open(entry_path, 'rb') as f:
+                grid = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 壊れたエントリは削除して読み込み直す
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(entry_path)  # 参照日時の更新（LRU 用）
+        except OSError:
+            pass
+        self.hits += 1
+        return grid
+
+    def put(self, content_hash, variant, grid):
+        entry_path = self._entry_path(content_hash, variant)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(grid, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, entry_path)
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        for dir_entry in os.scandir(self.cache_dir):
+            if not dir_entry.is_dir():
+                continue
+            for entry in os.scandir(dir_entry.path):
+                if entry.name.endswith('.pkl.z'):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # 上限の 9 割まで、参照日時の古いものから削除する
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for entry_path, size, _ in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(entry_path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+# 計算結果・数式・スタイルをまとめたエントリの種類（軽量な読み込みが有効な場合に read_sheet_source で作る）
+SHEET_CACHE_VARIANT = 'sheet'
+
+_sheet_cache = None
+
+def get_sheet_cache():
+    global _sheet_cache
+    if not SHEET_CACHE_ENABLED:
+        return None
+    if _sheet_cache is None:
+        _sheet_cache = SheetCache(SHEET_CACHE_DIR, SHEET_CACHE_MAX_MB * 1024 * 1024)
+    return _sheet_cache
+
+def load_active_sheet(file_path, data_only=False, with_styles=False, light=None):
+    """
+    ワークブックのアクティブシートを返す。
+    light の場合は read_sheet_values（値と結合範囲だけ）、それ以外は load_workbook で読む。
+    light を省略した場合、スタイルを使わない読み込みは LIGHT_XLSX_LOADER に従う。
+    キャッシュが有効な場合はブックの指紋で解析済みの SheetGrid を引き、無ければ同じ方法で読んで保存する。
+    LIGHT_XLSX_LOADER が有効な場合、スタイル付きの読み込みは read_sheet_source でシートの XML を
+    1回だけ走査した（計算結果・数式・スタイルをまとめた）エントリを作り、以降はどの読み込みもそれを使う。
+    値だけの読み込みがキャッシュに無い場合は、スタイルを読まずに値だけのエントリを作る。
+    """
+    if light is None:
+        light = LIGHT_XLSX_LOADER
+    light = light and not with_styles
+    cache = get_sheet_cache()
+    if cache is None:
+        if light:
+            return read_sheet_values(file_path, data_only=data_only)
+        return load_workbook(file_path, data_only=data_only).active
+    content_hash = workbook_fingerprint(file_path)
+    grid = cache.get(content_hash, SHEET_CACHE_VARIANT)
+    if grid is not None:
+        return grid.view(data_only=data_only, with_styles=with_styles)
+    if light:
+        variant = 'light-' + ('values' if data_only else 'formulas')
+    elif LIGHT_XLSX_LOADER and with_styles:
+        variant = SHEET_CACHE_VARIANT
+    else:
+        variant = ('values' if data_only else 'formulas') + ('-styled' if with_styles else '')
+    grid = cache.get(content_hash, variant)
+    if grid is None:
+        if light:
+            grid = read_sheet_values(file_path, data_only=data_only)
+        elif variant == SHEET_CACHE_VARIANT:
+            grid = read_sheet_source(file_path)
+        else:
+            grid = SheetGrid.from_worksheet(load_workbook(file_path, data_only=data_only).active,
+                                            with_styles=with_styles)
+        try:
+            cache.put(content_hash, variant, grid)
+        except Exception as e:
+            print(f"シートキャッシュの保存に失敗: {e}")
+    return grid.view(data_only=data_only, with_styles=with_styles)
+
+# ===== 軽量な値読み込み =====
+# 値だけを使う処理向けに、load_workbook を通さずに共有文字列・対象シートのXML・結合範囲と、
+# 日付の判定に必要な表示形式（numFmts / cellXfs）だけを読む。
+# 画像・図形・スタイルオブジェクト・テーマ・名前定義などは読み込まない。
+# セルの値の解釈には openpyxl 自身の WorkSheetParser を使うため、load_workbook と同じ値になる。
+
+def _read_date_style_ids(archive):
+    """日付・経過時間の表示形式を持つ cellXfs の番号の集合を返す"""
+    date_formats, timedelta_formats = set(), set()
+    if ARC_STYLE not in archive.namelist():
+        return date_formats, timedelta_formats
+    root = fromstring(archive.read(ARC_STYLE))
+    custom = {int(fmt.get('numFmtId')): fmt.get('formatCode')
+              for fmt in root.iterfind(f'{{{SHEET_MAIN_NS}}}numFmts/{{{SHEET_MAIN_NS}}}numFmt')}
+    for idx, xf in enumerate(root.iterfind(f'{{{SHEET_MAIN_NS}}}cellXfs/{{{SHEET_MAIN_NS}}}xf')):
+        num_fmt_id = int(xf.get('numFmtId', 0))
+        fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+        if is_date_format(fmt):
+            date_formats.add(idx)
+        if is_timedelta_format(fmt):
+            timedelta_formats.add(idx)
+    return date_formats, timedelta_formats
+
+def _sheet_part(archive, sheet_index=None):
+    """
+    シートの XML のパス・共有文字列・エポックを返す。
+    sheet_index が None ならアクティブシート、数値ならグラフシートを除いた先頭からの番号のシート。
+    """
+    valid_files = set(archive.namelist())
+    manifest = Manifest.from_tree(fromstring(archive.read(ARC_CONTENT_TYPES)))
+    workbook_part = _find_workbook_part(manifest).PartName[1:]
+    package = WorkbookPackage.from_tree(fromstring(archive.read(workbook_part)))
+    rels = get_dependents(archive, get_rels_path(workbook_part)).to_dict()
+    # load_workbook と同じ並び（グラフシートを含む）でシートを並べる
+    sheets = [rels[sheet.id] for sheet in package.sheets
+              if sheet.id and rels[sheet.id].target in valid_files]
+    if sheet_index is None:
+        rel = sheets[package.active]
+    else:
+        rel = [rel for rel in sheets if "chartsheet" not in rel.Type][sheet_index]
+    if "chartsheet" in rel.Type:
+        raise ValueError(f"グラフシートは読み込めません: {rel.target}")
+
+    shared_strings = []
+    strings_part = manifest.find(SHARED_STRINGS)
+    if strings_part is not None:
+        with archive.open(strings_part.PartName[1:]) as src:
+            shared_strings = read_string_table(src)
+    epoch = CALENDAR_MAC_1904 if package.properties.date1904 else WINDOWS_EPOCH
+    return rel.target, shared_strings, epoch
+
+def _sheet_hyperlinks(archive, sheet_part, parser):
+    """
+    シートのハイパーリンクを (範囲, 空のセルに入る値) のリストで返す。
+    load_workbook と同じく、リンク先はシートの rels から引き、無ければリンク内の場所を使う。
+    """
+    if not parser.hyperlinks.hyperlink:
+        return []
+    rels_path = get_rels_path(sheet_part)
+    rels = get_dependents(archive, rels_path) if rels_path in archive.namelist() else None
+    links = []
+    for link in parser.hyperlinks.hyperlink:
+        if not link.ref:
+            continue
+        target = link.target
+        if link.id:
+            target = rels.get(link.id).Target
+        links.append((link.ref, target or link.location))
+    return links
+
+def _merged_refs(parser):
+    return [merge.ref for merge in parser.merged_cells.mergeCell] if parser.merged_cells else []
+
+def _read_sheet_cells(file_path, sheet_index=None, data_only=True):
+    """
+    シートのセルを {(行, 列): (値, データ型)} で読み込み、結合範囲とハイパーリンクと合わせて返す。
+    sheet_index が None ならアクティブシート、数値ならグラフシートを除いた先頭からの番号のシート。
+    data_only が False の場合、数式のセルは計算結果ではなく数式を返す。
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_part, shared_strings, epoch = _sheet_part(archive, sheet_index)
+        date_formats, timedelta_formats = _read_date_style_ids(archive)
+        cells = {}
+        with archive.open(sheet_part) as src:
+            parser = WorkSheetParser(src, shared_strings, data_only=data_only, epoch=epoch,
+                                     date_formats=date_formats, timedelta_formats=timedelta_formats)
+            for _, row in parser.parse():
+                for cell in row:
+                    cells[(cell['row'], cell['column'])] = (cell['value'], cell['data_type'])
+        links = _sheet_hyperlinks(archive, sheet_part, parser)
+    return cells, list(dict.fromkeys(_merged_refs(parser))), links
+
+def _apply_hyperlink_values(values, merged_refs, links):
+    """
+    load_workbook がハイパーリンクを設定するときと同じく、空のセルにリンク先を入れる。
+    結合範囲で隠れたセルには入れず、単一セルのリンクが隠れたセルを指す場合は結合範囲の左上に入れる。
+    """
+    covered = {}
+    for ref in merged_refs:
+        merged_range = CellRange(ref)
+        top_left = (merged_range.min_row, merged_range.min_col)
+        for coordinate in merged_range.cells:
+            if coordinate != top_left:
+                covered.setdefault(coordinate, top_left)
+    for ref, text in links:
+        if ":" in ref:
+            targets = [coordinate for coordinate in CellRange(ref).cells if coordinate not in covered]
+        else:
+            coordinate = coordinate_to_tuple(ref)
+            targets = [covered.get(coordinate, coordinate)]
+        for coordinate in targets:
+            if values.get(coordinate) is None:
+                values[coordinate] = text
+
+def read_sheet_values(file_path, sheet_index=None, data_only=True):
+    """
+    シートの値と結合範囲だけを SheetGrid で返す（load_workbook(data_only=data_only) の軽量版）。
+    load_workbook と同様に、結合範囲の左上以外のセルは空にし、ハイパーリンクのある空のセルには
+    リンク先を入れ、max_row / max_column には結合範囲とハイパーリンクの範囲も含める。
+    """
+    if not LIGHT_READER_AVAILABLE:
+        wb = load_workbook(file_path, data_only=data_only)
+        ws = wb.active if sheet_index is None else wb.worksheets[sheet_index]
+        return SheetGrid.from_worksheet(ws)
+    cells, merged_refs, links = _read_sheet_cells(file_path, sheet_index, data_only)
+    values = {coordinate: value for coordinate, (value, _) in cells.items()}
+    _apply_hyperlink_values(values, merged_refs, links)
+    return build_sheet_grid(values, merged_refs, [ref for ref, _ in links])
+
+class _FormulaAndValueParser(WorkSheetParser):
+    """
+    数式とその計算結果（キャッシュ値）を1回の走査で読む WorkSheetParser。
+    parse_cell は data_only=False で読んだ場合と同じセル（数式のセルは数式）を返し、
+    数式のセルを data_only=True で読んだ場合の値は cached_values に残す。
+    """
+
+    def __init__(self, src, shared_strings, **kwargs):
+        super().__init__(src, shared_strings, data_only=True, **kwargs)
+        self.cached_values = {}
+
+    def parse_cell(self, element):
+        cell = super().parse_cell(element)
+        if element.find(FORMULA_TAG) is not None:
+            self.cached_values[(cell['row'], cell['column'])] = cell['value']
+            cell['value'], cell['data_type'] = self.parse_formula(element), 'f'
+        return cell
+
+def read_sheet_source(file_path):
+    """
+    アクティブシートの XML を1回だけ走査し、シートキャッシュの1エントリになる SheetGrid を作る。
+      - values   : load_workbook(data_only=True) で読んだ値
+      - formulas : 数式のセル → 数式（load_workbook(data_only=False) で読んだ値）
+      - styles   : load_workbook で読んだ場合のセルのスタイル
+    スタイル表は load_workbook と同じ apply_stylesheet で読み、結合範囲の処理（隠れたセルの
+    差し替え・罫線の補完）も openpyxl のワークシート上で行うため、スタイルも load_workbook と同じになる。
+    """
+    if not LIGHT_READER_AVAILABLE:
+        # 内部 API が無い版では load_workbook で計算結果と数式を1回ずつ読む
+        grid = SheetGrid.from_worksheet(load_workbook(file_path, data_only=True).active, with_styles=True)
+        formula_sheet = load_workbook(file_path, data_only=False).active
+        grid.formulas = {(cell.row, cell.column): cell.value
+                         for row in formula_sheet.iter_rows() for cell in row if cell.data_type == 'f'}
+        return grid
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_part, shared_strings, epoch = _sheet_part(archive)
+        style_book = Workbook()
+        apply_stylesheet(archive, style_book)
+        style_sheet = Worksheet(style_book)
+        cell_styles = style_book._cell_styles
+        values = {}
+        with archive.open(sheet_part) as src:
+            parser = _FormulaAndValueParser(src, shared_strings, epoch=epoch,
+                                            date_formats=style_book._date_formats,
+                                            timedelta_formats=style_book._timedelta_formats)
+            for _, row in parser.parse():
+                for cell in row:
+                    values[(cell['row'], cell['column'])] = cell['value']
+                    style_array = cell_styles[cell['style_id']]
+                    # スタイルのないセルは作らない（結合範囲の左上のセルは必要なら openpyxl が作る）
+                    if any(style_array):
+                        style_sheet._cells[(cell['row'], cell['column'])] = Cell(
+                            style_sheet, row=cell['row'], column=cell['column'], style_array=style_array)
+        links = _sheet_hyperlinks(archive, sheet_part, parser)
+    for ref in _merged_refs(parser):
+        style_sheet._clean_merge_range(MergedCellRange(style_sheet, ref))
+    merged_refs = list(dict.fromkeys(_merged_refs(parser)))
+    link_refs = [ref for ref, _ in links]
+
+    # 数式のセル（結合範囲で隠れたものを除く）は、計算結果の値と数式の両方を持つ
+    # （数式は空にならないため、ハイパーリンクのリンク先が入るのは計算結果の値だけ）
+    formulas = {coordinate: values[coordinate] for coordinate in parser.cached_values
+                if not isinstance(style_sheet._cells.get(coordinate), MergedCell)}
+    values.update(parser.cached_values)
+    _apply_hyperlink_values(values, merged_refs, links)
+    grid = build_sheet_grid(values, merged_refs, link_refs)
+
+    styles = []
+    style_ids = [[-1] * grid.max_column for _ in range(grid.max_row)]
+    local_ids = {}
+    for (row, column), cell in sorted(style_sheet._cells.items()):
+        if not cell.has_style:
+            continue
+        style_id = cell.style_id
+        if style_id not in local_ids:
+            local_ids[style_id] = len(styles)
+            styles.append((copy(cell.font), copy(cell.border), copy(cell.fill),
+                           copy(cell.number_format), copy(cell.protection), copy(cell.alignment)))
+        style_ids[row - 1][column - 1] = local_ids[style_id]
+    grid.styles, grid.style_ids, grid.formulas = styles, style_ids, formulas
+    return grid
+
+def build_sheet_grid(values, merged_refs, extra_refs=()):
+    """
+    {(行, 列): 値} から load_workbook 後のシートと同じ SheetGrid を作る。
+    結合範囲の左上以外のセルは空にし、max_row / max_column には結合範囲と extra_refs の範囲も含める。
+    """
+    values = dict(values)
+    for ref in merged_refs:
+        merged_range = CellRange(ref)
+        top_left = (merged_range.min_row, merged_range.min_col)
+        top_left_value = values.get(top_left)
+        for coordinate in merged_range.cells:
+            values[coordinate] = None
+        values[top_left] = top_left_value
+    for ref in extra_refs:
+        for coordinate in CellRange(ref).cells:
+            values.setdefault(coordinate, None)
+    max_row = max((row for row, _ in values), default=1)
+    max_column = max((column for _, column in values), default=1)
+    rows = [[None] * max_column for _ in range(max_row)]
+    for (row, column), value in values.items():
+        rows[row - 1][column - 1] = value
+    return SheetGrid(rows, max_row, max_column, merged_refs)
+
+def read_excel_values(file_path, sheet_index=0, header=0):
+    """
+    pd.read_excel(file_path) の軽量版。sheet_index 番目のシートを読み、cells_to_frame で DataFrame にする。
+    """
+    if not LIGHT_READER_AVAILABLE:
+        return pd.read_excel(file_path, sheet_name=sheet_index, header=header)
+    cells, _, _ = _read_sheet_cells(file_path, sheet_index)
+    return cells_to_frame(cells, header=header)
+
+def cells_to_frame(cells, header=0):
+    """
+    {(行, 列): (値, データ型)} から pd.read_excel と同じ DataFrame を作る。
+    pandas の openpyxl 読み込みと同じく、空セルを ""、エラーを NaN、整数値の浮動小数を int にし、
+    末尾の空行・空セルを除いてから TextParser に渡す。
+    """
+    if not cells:
+        return pd.DataFrame()
+    max_row = max(row for row, _ in cells)
+    data = [[] for _ in range(max_row)]
+    for (row, column), (value, data_type) in sorted(cells.items()):
+        if value is None or value == "":
+            continue
+        if data_type == 'e':
+            value = np.nan
+        elif data_type == 'n' and int(value) == value:
+            value = int(value)
+        row_values = data[row - 1]
+        row_values.extend([""] * (column - 1 - len(row_values)))
+        row_values.append(value)
+    while data and not data[-1]:
+        data.pop()
+    if not data:
+        return pd.DataFrame()
+    max_width = max(len(row_values) for row_values in data)
+    data = [row_values + [""] * (max_width - len(row_values)) for row_values in data]
+    try:
+        return TextParser(data, header=header, skip_blank_lines=False).read()
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+# ===== フェーズ間の受け渡し用サイドカー =====
+# 各フェーズの出力 xlsx と同じ場所に、次のフェーズが読み戻すはずの値を SheetGrid で保存する。
+# xlsx の指紋（workbook_fingerprint）が一致する場合だけ使い、手で編集された場合は xlsx を読む。
+# 共有ドライブ上に置くため、pickle ではなく JSON（日付などはマニフェストと同じタグ付きの値）で保存する。
+SIDECAR_VERSION = 2
+
+class SidecarUnsupportedValue(Exception):
+    """読み戻したときの値を再現できないセル（エラー値・リッチテキストなど）"""
+
+def sidecar_path(xlsx_path):
+    return f"{xlsx_path}.json.z"
+
+def _read_back_value(cell, epoch):
+    """
+    保存したセルを load_workbook(data_only=True) で読み戻したときの値を返す。
+    書き込み（safe_string / to_excel）と読み込み（_cast_number / from_excel）を openpyxl と同じ関数でたどる。
+    """
+    value = cell._value
+    if value is None or (isinstance(value, str) and value == ""):
+        return None
+    if cell.data_type == 'f':
+        return None  # 数式は計算結果を保存しないため、読み戻すと空になる
+    if cell.data_type == 's':
+        if not isinstance(value, str) or '\r' in value:
+            raise SidecarUnsupportedValue(cell.coordinate)
+        return value
+    if cell.data_type == 'd':
+        value = to_excel(value, epoch)
+    elif cell.data_type not in ('n', 'b'):
+        raise SidecarUnsupportedValue(cell.coordinate)
+    text = safe_string(value)
+    if text == "":
+        return None
+    number = _cast_number(text)
+    if cell.data_type == 'b':
+        return bool(number)
+    if is_date_format(cell.number_format):
+        try:
+            return from_excel(number, epoch, timedelta=is_timedelta_format(cell.number_format))
+        except (OverflowError, ValueError):
+            raise SidecarUnsupportedValue(cell.coordinate)
+    return number
+
+def snapshot_written_sheet(ws):
+    """保存済みのワークシートを読み戻したときの SheetGrid を、ファイルを読まずに作る"""
+    epoch = ws.parent.epoch
+    values = {}
+    for coordinate, cell in ws._cells.items():
+        if cell.hyperlink is not None:
+            # 読み込み時にリンク先が値に入ることがあるため対象外
+            raise SidecarUnsupportedValue(cell.coordinate)
+        # 値もスタイルもコメントもないセルは保存されない
+        if cell._value is None and not cell.has_style and not getattr(cell, '_comment', None):
+            continue
+        values[coordinate] = _read_back_value(cell, epoch)
+    merged_refs = [merged_range.coord for merged_range in ws.merged_cells.ranges]
+    return build_sheet_grid(values, merged_refs)
+
+def write_sheet_sidecar(ws, xlsx_path):
+    """保存直後の xlsx に対応するサイドカーを書く。再現できない値があれば作らない"""
+    if not PHASE_SIDECARS or not LIGHT_READER_AVAILABLE:
+        return
+    path = sidecar_path(xlsx_path)
+    try:
+        grid = snapshot_written_sheet(ws)
+    except SidecarUnsupportedValue:
+        grid = None
+    try:
+        if grid is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        payload = {'version': SIDECAR_VERSION, 'fingerprint': workbook_fingerprint(xlsx_path),
+                   'sheet_title': ws.title, 'max_row': grid.max_row, 'max_column': grid.max_column,
+                   'merged_refs': grid.merged_refs,
+                   'values': [[_encode_manifest_value(value) for value in row_values] for row_values in grid.values]}
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(payload, ensure_ascii=False).encode('utf-8'), 1))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"サイドカーの保存に失敗: {e}")
+
+def save_workbook_with_sidecar(wb, xlsx_path):
+    wb.save(xlsx_path)
+    write_sheet_sidecar(wb.active, xlsx_path)
+
+def write_excel_with_sidecar(df, xlsx_path, **to_excel_kwargs):
+    """df.to_excel(xlsx_path, ...) と同じ xlsx を書き、openpyxl で書いた場合はサイドカーも書く"""
+    with pd.ExcelWriter(xlsx_path) as writer:
+        df.to_excel(writer, **to_excel_kwargs)
+    ws = next(iter(writer.sheets.values()), None)
+    if isinstance(ws, Worksheet):
+        write_sheet_sidecar(ws, xlsx_path)
+
+def load_sidecar_grid(xlsx_path, sheet_name=None):
+    """xlsx の指紋が一致するサイドカーの SheetGrid を返す。使えなければ None"""
+    if not PHASE_SIDECARS:
+        return None
+    try:
+        with open(sidecar_path(xlsx_path), 'rb') as f:
+            payload = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return None
+    if not isinstance(payload, dict) or payload.get('version') != SIDECAR_VERSION:
+        return None
+    if sheet_name not in (None, 0, payload.get('sheet_title')):
+        return None
+    try:
+        if payload.get('fingerprint') != workbook_fingerprint(xlsx_path):
+            return None
+    except OSError:
+        return None
+    try:
+        values = [[_decode_manifest_value(value) for value in row_values] for row_values in payload['values']]
+        return SheetGrid(values, payload['max_row'], payload['max_column'], payload['merged_refs'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _read_back_data_type(value):
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, (int, float)):
+        return 'n'
+    return 's' if isinstance(value, str) else 'd'
+
+def read_excel_with_sidecar(xlsx_path, sheet_name=0, header=0, usecols=None):
+    """pd.read_excel と同じ DataFrame を返す。サイドカーが使えれば xlsx は読まない"""
+    grid = load_sidecar_grid(xlsx_path, sheet_name)
+    if grid is not None:
+        cells = {(row, column): (value, _read_back_data_type(value))
+                 for row, row_values in enumerate(grid.values, start=1)
+                 for column, value in enumerate(row_values, start=1) if value is not None}
+        df = cells_to_frame(cells, header=header)
+    elif LIGHT_XLSX_LOADER and isinstance(sheet_name, int):
+        df = read_excel_values(xlsx_path, sheet_name, header)
+    else:
+        return pd.read_excel(xlsx_path, sheet_name=sheet_name, header=header, usecols=usecols)
+    return df[usecols] if usecols is not None else df
+
 # ===== Phase1: パターン一覧とファイル別パターン作成 =====
-def process_phase1(target_path, municipality_name, phase1_output_dir, log_file_path):
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"\n\n==== Phase1 実行開始: {datetime.now()} ====\nターゲットパス: {target_path}\n")
-    
-    target_path = Path(target_path)
-    xlsx_files = []
-    # サブフォルダ内の.xlsxファイルを収集
-    for folder in target_path.iterdir():
-        if folder.is_dir() and re.match(r'^[a-zA-Z0-9]', folder.name):
-            for xlsx_file in folder.glob('*.xlsx'):
-                xlsx_files.append((folder.name, xlsx_file))
-    
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"Found {len(xlsx_files)} xlsx files in target path\n")
-    
-    output_data = []       # パターン定義用データ
-    file_pattern_data = [] # ファイル別パターン情報
-    pattern_counter = 0
-    existing_patterns = {}
-
-    def cache_merged_cells(sheet):
-        merged_cells_cache = {}
-        for merged_range in sheet.merged_cells.ranges:
-            for row in range(merged_range.min_row, merged_range.max_row + 1):
-                for col in range(merged_range.min_col, merged_range.max_col + 1):
-                    merged_cells_cache[(row, col)] = (merged_range.min_row, merged_range.min_col)
-        return merged_cells_cache
-
-    def get_merged_cell_value(sheet, cell, merged_cells_cache):
-        if (cell.row, cell.column) in merged_cells_cache:
-            min_row, min_col = merged_cells_cache[(cell.row, cell.column)]
-            return sheet.cell(min_row, min_col).value
-        return cell.value
-
-    def get_right_column_value(sheet, row, column, merged_cells_cache):
-        if column + 1 <= sheet.max_column:
-            right_col_cell = sheet.cell(row, column + 1)
-            right_value = get_merged_cell_value(sheet, right_col_cell, merged_cells_cache)
-            if right_value:
-                return f"+++{right_value}"
-        return ""
-
-    def get_values_until_last_data(sheet, start_cell, merged_cells_cache):
+# 対象ファイル（サイズと更新日時は一覧取得時に取得済み）
+SourceFile = namedtuple('SourceFile', ['folder_name', 'path', 'name', 'size', 'mtime_ns'])
+
+def is_temporary_excel_file(file_name):
+    # Excel のロックファイル（~$xxx.xlsx）や LibreOffice の一時ファイル
+    return file_name.startswith('~$') or file_name.startswith('.~')
+
+def _scan_source_folder(folder_name, folder_path):
+    """企業フォルダ1つ分の .xlsx を (対象ファイル, 除外した一時ファイル数) で返す"""
+    source_files = []
+    skipped = 0
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not fnmatch.fnmatch(entry.name, '*.xlsx') or not entry.is_file():
+                continue
+            if is_temporary_excel_file(entry.name):
+                skipped += 1
+                continue
+            stat = entry.stat()
+            source_files.append(SourceFile(folder_name, entry.path, entry.name, stat.st_size, stat.st_mtime_ns))
+    return source_files, skipped
+
+def discover_source_files(target_path, workers=None):
+    """
+    TARGET_PATH 直下の企業フォルダ（英数字で始まるもの）から .xlsx を集める。
+    フォルダごとの一覧取得はスレッドで並列に行い、順序は従来の iterdir/glob と同じにする。
+    戻り値は (SourceFile のリスト, 除外した一時ファイル数)。
+    """
+    if workers is None:
+        workers = DISCOVERY_WORKERS
+    with os.scandir(target_path) as entries:
+        folders = [(entry.name, entry.path) for entry in entries
+                   if entry.is_dir() and re.match(r'^[a-zA-Z0-9]', entry.name)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda folder: _scan_source_folder(*folder), folders))
+    source_files = [source_file for files, _ in results for source_file in files]
+    return source_files, sum(skipped for _, skipped in results)
+
+MERGE_CELL_REF_PATTERN = re.compile(rb'<(?:\w+:)?mergeCell\s+ref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"')
+
+class MergedCellIndex:
+    """
+    結合セル範囲の索引。
+    結合範囲を1セルずつ展開せず、行ごとに列区間（開始列でソート）を持ち、
+    二分探索でセルが属する範囲を引く。左上セルの値も範囲ごとに1回だけ保持する。
+    Phase1・Phase3・Phase4 で共通に使う。
+    """
+
+    def __init__(self, merged_ranges):
+        # (min_row, min_col, max_row, max_col) のタプル
+        self.ranges = [(r.min_row, r.min_col, r.max_row, r.max_col) for r in merged_ranges]
+        self.top_left_values = {}
+        self.last_row = max((bounds[2] for bounds in self.ranges), default=0)
+        rows = {}
+        self._top_left_cols = {}
+        for bounds in self.ranges:
+            for row in range(bounds[0], bounds[2] + 1):
+                rows.setdefault(row, []).append(bounds)
+            self._top_left_cols.setdefault(bounds[0], []).append(bounds[1])
+        self._rows = {}
+        for row, entries in rows.items():
+            entries.sort(key=lambda bounds: bounds[1])
+            self._rows[row] = ([bounds[1] for bounds in entries], entries)
+
+    @classmethod
+    def from_sheet(cls, sheet, with_values=True):
+        index = cls(sheet.merged_cells.ranges)
+        if with_values:
+            for min_row, min_col, _, _ in index.ranges:
+                index.top_left_values[(min_row, min_col)] = sheet.cell(min_row, min_col).value
+        return index
+
+    def find(self, row, col):
+        """セルを含む結合範囲 (min_row, min_col, max_row, max_col) を返す。結合されていなければ None"""
+        row_index = self._rows.get(row)
+        if row_index is None:
+            return None
+        starts, entries = row_index
+        i = bisect_right(starts, col) - 1
+        if i >= 0 and col <= entries[i][3]:
+            return entries[i]
+        return None
+
+    def is_covered(self, row, col):
+        """結合範囲のうち左上以外のセルなら True"""
+        bounds = self.find(row, col)
+        return bounds is not None and (bounds[0], bounds[1]) != (row, col)
+
+    def top_left_cols(self, row):
+        """row 行にある結合範囲の左上セルの列番号"""
+        return self._top_left_cols.get(row, ())
+
+    def value(self, row, col, raw_value):
+        """結合セルなら左上セルの値、それ以外は raw_value を返す"""
+        bounds = self.find(row, col)
+        if bounds is None:
+            return raw_value
+        return self.top_left_values.get((bounds[0], bounds[1]))
+
+def read_merged_cell_ranges(archive, sheet_path, chunk_size=1 << 20):
+    """
+    シートXMLから結合セル範囲だけを取り出す。
+    read_only モードでは結合セルが読み込まれないため、XMLを一定サイズずつ
+    展開しながら mergeCell 要素を探す（シート全体をメモリに載せない）。
+    """
+    ranges = []
+    overlap = 256  # mergeCell 要素1つ分より十分長い重なり
+    tail = b""
+    with archive.open(sheet_path) as src:
+        while True:
+            chunk = src.read(chunk_size)
+            buffer = tail + chunk
+            limit = len(buffer) if not chunk else len(buffer) - overlap
+            consumed = 0
+            for match in MERGE_CELL_REF_PATTERN.finditer(buffer):
+                if match.end() > limit:
+                    break
+                ranges.append(CellRange(match.group(1).decode('ascii')))
+                consumed = match.end()
+            if not chunk:
+                break
+            tail = buffer[max(consumed, limit - overlap, 0):]
+    return ranges
+
+def get_merged_cell_value(sheet, cell, merged_index):
+    return merged_index.value(cell.row, cell.column, cell.value)
+
+def iter_resolved_column_pairs(sheet, row, column, merged_index):
+    """
+    row 行目以降について、column 列とその右隣の列の値を結合セル解決済みの組で順に返す。
+    右隣がシートの範囲外なら右側は None。行は iter_rows で1回だけ読む。
+    """
+    has_right = column + 1 <= sheet.max_column
+    max_col = column + 1 if has_right else column
+    for r, row_values in enumerate(
+            sheet.iter_rows(min_row=row, max_row=sheet.max_row, min_col=column, max_col=max_col, values_only=True),
+            start=row):
+        value = merged_index.value(r, column, row_values[0])
+        right_value = merged_index.value(r, column + 1, row_values[1]) if has_right else None
+        yield value, right_value
+
+def get_values_until_last_data(sheet, start_cell, merged_index):
+    values = []
+    empty_count = 0
+    max_empty_cells = 10
+    previous = None
+    for offset, (value, right_value) in enumerate(
+            iter_resolved_column_pairs(sheet, start_cell.row + 1, start_cell.column, merged_index)):
+        current = value
+        if value is None or value == "":
+            empty_count += 1
+        else:
+            empty_count = 0
+            if offset > 0 and value == previous:
+                right_value = f"+++{right_value}" if right_value else ""
+                value = f"{value}{right_value}"
+        previous = current
+        values.append(value)
+        if empty_count >= max_empty_cells:
+            break
+    return [v for v in values if v is not None and v != ""]
+
+def find_anchor_cell(sheet, merged_index):
+    """シート内で行優先で最初の「返礼品コード」セルを返す（なければ None）"""
+    for row in sheet.iter_rows():
+        for cell in row:
+            if get_merged_cell_value(sheet, cell, merged_index) == '返礼品コード':
+                return cell
+    return None
+
+def scan_file_phase1(file_path):
+    """
+    1ファイル分の「返礼品コード」探索を行う。
+    プロセスプールからも呼び出せるようモジュールレベルに置き、
+    結果は (状態, A1形式, 列の値またはエラー内容) のタプルで返す。
+      - 'found'      : 返礼品コードが見つかった
+      - 'not_found'  : 返礼品コードが見つからなかった
+      - 'load_error' : ワークブックの読み込みに失敗
+      - 'error'      : 読み込み後の処理で失敗
+    """
+    try:
+        sheet = load_active_sheet(file_path, data_only=True)
+    except Exception as e:
+        return ('load_error', None, str(e))
+    try:
+        merged_index = MergedCellIndex.from_sheet(sheet)
+        cell = find_anchor_cell(sheet, merged_index)
+        if cell is None:
+            return ('not_found', None, None)
+        all_values = get_values_until_last_data(sheet, cell, merged_index)
+        return ('found', f"{cell.column_letter}{cell.row}", all_values)
+    except Exception as e:
+        return ('error', None, str(e))
+
+def _canonical_pattern_value(value):
+    # == で等しい値（1 と 1.0、True と 1 など）が同じ表現になるよう数値を正規化する
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{type(value).__name__}:{value!r}"
+
+def pattern_fingerprint(values):
+    """列の値リストから、プロセスや実行をまたいで安定なハッシュ文字列を作る"""
+    canonical = "\n".join(_canonical_pattern_value(v) for v in values)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+class PatternRegistry:
+    """
+    列の値リスト → パターン名 の対応表。
+    値リストのハッシュをキーに O(1) で引き、ハッシュが衝突した場合も
+    リストの完全一致で確認するため、従来の線形探索と同じ判定になる。
+    パターンごとのファイル数も保持する。
+    """
+
+    def __init__(self):
+        self._buckets = {}  # fingerprint -> [(パターン名, 値リスト), ...]
+        self.patterns = {}  # パターン名 -> 値リスト（登録順）
+        self.counts = {}    # パターン名 -> ファイル数
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def lookup(self, values):
+        for pattern_name, pattern_values in self._buckets.get(pattern_fingerprint(values), ()):
+            if pattern_values == values:
+                return pattern_name
+        return None
+
+    def register(self, pattern_name, values):
+        self._buckets.setdefault(pattern_fingerprint(values), []).append((pattern_name, values))
+        self.patterns[pattern_name] = values
+        self.counts[pattern_name] = 0
+
+    def record_file(self, pattern_name):
+        self.counts[pattern_name] += 1
+
+def scan_file_phase1_streaming(file_path):
+    """
+    scan_file_phase1 の省メモリ版（結果の形式・内容は同じ）。
+    read_only モードで行を先頭から順に読み、返礼品コードの列を集め終えた
+    時点で読み込みを打ち切る。保持するのは結合セルの左上の値と直前の行の値
+    だけなので、メモリ使用量はシートの大きさではなく読んだ行数で決まる。
+    """
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        return ('load_error', None, str(e))
+    rows = None
+    try:
+        sheet = workbook.active
+        archive = getattr(workbook, '_archive', None)
+        sheet_path = getattr(sheet, '_worksheet_path', None)
+        if archive is None or sheet_path is None:
+            # openpyxl の内部属性（read_only のブックの zip とシートのパス）が無い版では通常の読み込みで探す
+            return scan_file_phase1(file_path)
+        merged_index = MergedCellIndex(read_merged_cell_ranges(archive, sheet_path))
+
+        def resolve(row_values, row, col):
+            raw_value = row_values[col - 1] if col <= len(row_values) else None
+            return merged_index.value(row, col, raw_value)
+
+        # シート先頭の dimension は誤っていることがあるため使わない
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        anchor = None
         values = []
         empty_count = 0
         max_empty_cells = 10
-        for r in range(start_cell.row + 1, sheet.max_row + 1):
-            cell = sheet.cell(r, start_cell.column)
-            value = get_merged_cell_value(sheet, cell, merged_cells_cache)
+        previous_value = None
+        r = 0
+        while True:
+            row_values = next(rows, None)
+            if row_values is None:
+                # 最終行より下に結合セルが続く場合は空行として読み進める
+                if anchor is None or r >= merged_index.last_row:
+                    break
+                row_values = ()
+            r += 1
+            for col in merged_index.top_left_cols(r):
+                merged_index.top_left_values[(r, col)] = row_values[col - 1] if col <= len(row_values) else None
+            if anchor is None:
+                for col, cell_value in enumerate(row_values, start=1):
+                    if cell_value == '返礼品コード' and not merged_index.is_covered(r, col):
+                        anchor = (r, col)
+                        break
+                continue
+            anchor_row, anchor_col = anchor
+            current_value = resolve(row_values, r, anchor_col)
+            value = current_value
             if value is None or value == "":
                 empty_count += 1
             else:
                 empty_count = 0
-                if r > start_cell.row + 1 and value == get_merged_cell_value(sheet, sheet.cell(r - 1, start_cell.column), merged_cells_cache):
-                    right_value = get_right_column_value(sheet, r, start_cell.column, merged_cells_cache)
+                if r > anchor_row + 1 and value == previous_value:
+                    right_value = resolve(row_values, r, anchor_col + 1)
+                    right_value = f"+++{right_value}" if right_value else ""
                     value = f"{value}{right_value}"
             values.append(value)
+            previous_value = current_value
             if empty_count >= max_empty_cells:
                 break
-        return [v for v in values if v is not None and v != ""]
+        if anchor is None:
+            return ('not_found', None, None)
+        return ('found', f"{get_column_letter(anchor[1])}{anchor[0]}",
+                [v for v in values if v is not None and v != ""])
+    except Exception as e:
+        return ('error', None, str(e))
+    finally:
+        if rows is not None:
+            rows.close()
+        workbook.close()
 
-    def find_existing_pattern(pattern_data):
-        for pattern_name, existing_pattern in existing_patterns.items():
-            if pattern_data == existing_pattern:
-                return pattern_name
+PHASE1_SCANNERS = {
+    'full': scan_file_phase1,
+    'stream': scan_file_phase1_streaming,
+}
+
+def timed_scan_file_phase1(scan_mode, file_path):
+    """読み込み結果と所要秒数の組を返す（ワーカー側で計測する）"""
+    started = time.perf_counter()
+    scan_result = PHASE1_SCANNERS[scan_mode](file_path)
+    return scan_result, time.perf_counter() - started
+
+# ----- Phase1 マニフェスト（前回の読み込み結果） -----
+MANIFEST_VERSION = 2
+
+def _encode_manifest_value(value):
+    # JSON にない型はタグ付きの dict にして保存する
+    if isinstance(value, datetime):
+        return {'__type__': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, date):
+        return {'__type__': 'date', 'value': value.isoformat()}
+    if isinstance(value, dt_time):
+        return {'__type__': 'time', 'value': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {'__type__': 'timedelta', 'value': value.total_seconds()}
+    return value
+
+def _decode_manifest_value(value):
+    if not isinstance(value, dict):
+        return value
+    value_type = value['__type__']
+    if value_type == 'datetime':
+        return datetime.fromisoformat(value['value'])
+    if value_type == 'date':
+        return date.fromisoformat(value['value'])
+    if value_type == 'time':
+        return dt_time.fromisoformat(value['value'])
+    if value_type == 'timedelta':
+        return timedelta(seconds=value['value'])
+    raise ValueError(f"不明なマニフェスト値の型: {value_type}")
+
+def load_phase1_manifest(manifest_path):
+    """前回のマニフェストを {ファイルパス: エントリ} で返す。存在しない・形式が古い場合は空"""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return {entry['path']: entry for entry in manifest.get('files', [])}
+
+def save_phase1_manifest(manifest_path, entries):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': entries}, f, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+def probe_manifest_entry(previous_entry, source_file):
+    """
+    一覧取得時のサイズ・更新日時とブックの指紋から、
+    (マニフェスト用のファイル情報, 前回の結果をそのまま使えるか) を返す。
+    サイズと更新日時が同じなら指紋は再計算しない。
+    """
+    file_path = source_file.path
+    file_info = {'path': file_path, 'size': source_file.size, 'mtime': source_file.mtime_ns}
+    if (previous_entry and previous_entry['size'] == file_info['size']
+            and previous_entry['mtime'] == file_info['mtime']):
+        file_info['fingerprint'] = previous_entry['fingerprint']
+        return file_info, True
+    file_info['fingerprint'] = workbook_fingerprint(file_path)
+    return file_info, bool(previous_entry) and previous_entry['fingerprint'] == file_info['fingerprint']
+
+def manifest_entry_to_scan_result(entry):
+    values = entry['values']
+    if values is not None:
+        values = [_decode_manifest_value(v) for v in values]
+    return (entry['status'], entry['anchor'], values)
+
+def scan_result_to_manifest_entry(file_info, scan_result):
+    status, anchor, values = scan_result
+    if values is not None:
+        values = [_encode_manifest_value(v) for v in values]
+    return dict(file_info, status=status, anchor=anchor, values=values)
+
+# ----- パターンカタログ（自治体をまたいだパターンの記録） -----
+class PatternCatalog:
+    """
+    これまでに見つかったパターンを自治体をまたいで保持する SQLite カタログ。
+    パターンは pattern_fingerprint をキーに1回の索引検索で引き、値リストの
+    一致も確認する。どの自治体のどのパターン名に対応したかも記録するため、
+    標準テンプレートのように共通のレイアウトは初出の自治体・パターン名をログで確認できる。
+    （Phase2 の見出しの配置はカタログに保存しておらず、各自治体の Phase2 で毎回作る）
+    """
+
+    def __init__(self, catalog_path):
+        os.makedirs(os.path.dirname(catalog_path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(catalog_path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS patterns (
+                catalog_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint TEXT NOT NULL UNIQUE,
+                values_json TEXT NOT NULL,
+                anchor TEXT,
+                first_municipality TEXT,
+                first_pattern_name TEXT,
+                first_seen TEXT,
+                last_seen TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pattern_usage (
+                municipality TEXT NOT NULL,
+                pattern_name TEXT NOT NULL,
+                catalog_id INTEGER NOT NULL REFERENCES patterns(catalog_id),
+                file_count INTEGER NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (municipality, pattern_name)
+            );
+            CREATE INDEX IF NOT EXISTS pattern_usage_catalog_id ON pattern_usage(catalog_id);
+        """)
+
+    @staticmethod
+    def format_id(catalog_id):
+        return f"CAT{str(catalog_id).zfill(6)}"
+
+    def resolve(self, values):
+        """既知のパターンなら (catalog_id, 初出の自治体, 初出のパターン名) を返す。未知なら None"""
+        row = self.connection.execute(
+            "SELECT catalog_id, values_json, first_municipality, first_pattern_name FROM patterns WHERE fingerprint = ?",
+            (pattern_fingerprint(values),)).fetchone()
+        if row is None:
+            return None
+        stored_values = [_decode_manifest_value(v) for v in json.loads(row[1])]
+        if stored_values != values:
+            return None
+        return row[0], row[2], row[3]
+
+    def register(self, values, anchor, municipality, pattern_name):
+        """
+        パターンをカタログに登録し (catalog_id, known) を返す。
+        既知のパターンなら最終確認日時だけ更新し、known は resolve と同じ (catalog_id, 初出の自治体, 初出のパターン名)。
+        新しく登録した場合の known は None。
+        """
+        now = datetime.now().isoformat()
+        known = self.resolve(values)
+        if known is not None:
+            self.connection.execute("UPDATE patterns SET last_seen = ? WHERE catalog_id = ?", (now, known[0]))
+            return known[0], known
+        cursor = self.connection.execute(
+            "INSERT INTO patterns (fingerprint, values_json, anchor, first_municipality, first_pattern_name, first_seen, last_seen)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (pattern_fingerprint(values),
+             json.dumps([_encode_manifest_value(v) for v in values], ensure_ascii=False),
+             anchor, municipality, pattern_name, now, now))
+        return cursor.lastrowid, None
+
+    def record_usage(self, municipality, pattern_catalog_ids, pattern_counts):
+        """自治体のパターン名 → catalog_id の対応を置き換える"""
+        now = datetime.now().isoformat()
+        self.connection.execute("DELETE FROM pattern_usage WHERE municipality = ?", (municipality,))
+        self.connection.executemany(
+            "INSERT INTO pattern_usage (municipality, pattern_name, catalog_id, file_count, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(municipality, pattern_name, catalog_id, pattern_counts.get(pattern_name, 0), now)
+             for pattern_name, catalog_id in pattern_catalog_ids.items()])
+
+    def municipalities_using(self, catalog_id):
+        """catalog_id のパターンを使っている (自治体, パターン名) の一覧"""
+        return self.connection.execute(
+            "SELECT municipality, pattern_name FROM pattern_usage WHERE catalog_id = ? ORDER BY municipality",
+            (catalog_id,)).fetchall()
+
+# ----- 類似パターンのクラスタリング（MinHash / LSH） -----
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4  # バンドあたりの行数（MINHASH_BANDS * MINHASH_ROWS 個のハッシュ関数を使う）
+
+def layout_tokens(values):
+    """列の値を表記ゆれ（全角/半角・空白）を除いた項目名の集合にする"""
+    tokens = set()
+    for value in values:
+        token = re.sub(r'\s+', '', unicodedata.normalize('NFKC', str(value)))
+        if token:
+            tokens.add(token)
+    return tokens
+
+def _stable_token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+# multiply-shift 方式のハッシュ族の係数（実行をまたいで同じ署名になるよう固定シード）
+_minhash_rng = np.random.default_rng(1)
+MINHASH_MULTIPLIERS = _minhash_rng.integers(1, 2 ** 63, size=MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64) | np.uint64(1)
+MINHASH_OFFSETS = _minhash_rng.integers(0, 2 ** 63, size=MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64)
+
+def minhash_signature(tokens):
+    """トークン集合の MinHash 署名（uint64 の配列）。空集合は None"""
+    if not tokens:
         return None
+    hashes = np.array([_stable_token_hash(token) for token in tokens], dtype=np.uint64)
+    # uint64 の桁あふれはそのまま使う
+    permuted = hashes[:, None] * MINHASH_MULTIPLIERS[None, :] + MINHASH_OFFSETS[None, :]
+    return permuted.min(axis=0)
 
-    for i, (folder_name, xlsx_file) in enumerate(xlsx_files):
-        file_path = str(xlsx_file)
-        file_name = xlsx_file.name
-        try:
-            print(f"Processing file: {file_name}")
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write(f"\nProcessing file: {file_name}\n")
+def cluster_near_duplicate_patterns(patterns, threshold=None):
+    """
+    値リストの似たパターンをまとめる。
+    MinHash 署名をバンドに分けてハッシュし（LSH）、同じバケットに入ったパターンどうしだけ
+    Jaccard 類似度を確認するため、比較回数はパターン数の2乗にならない。
+    patterns は {パターン名: 値リスト}（登録順）。
+    戻り値は {パターン名: クラスタ代表のパターン名}（代表は各クラスタで最初に登録されたもの）。
+    """
+    if threshold is None:
+        threshold = NEAR_DUPLICATE_THRESHOLD
+    names = list(patterns)
+    tokens = [layout_tokens(patterns[name]) for name in names]
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets = {}  # (バンド, バンドの署名) -> そのバケットに入ったパターンの番号のリスト
+    for i, token_set in enumerate(tokens):
+        signature = minhash_signature(token_set)
+        if signature is None:
+            continue
+        for band in range(MINHASH_BANDS):
+            key = (band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tobytes())
+            members = buckets.setdefault(key, [])
+            # バケットの先頭だけでなく全員と比べる（先頭とは似ていなくても他の誰かと似ていることがある）
+            for j in members:
+                if find(j) == find(i):
+                    continue
+                similarity = len(tokens[j] & token_set) / len(tokens[j] | token_set)
+                if similarity >= threshold:
+                    # 代表が先に登録されたパターンになるよう、番号の小さい方を根にする
+                    root_a, root_b = find(j), find(i)
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+            members.append(i)
+    return {name: names[find(i)] for i, name in enumerate(names)}
+
+# ----- 類似パターンの検索（ビットセット / Jaccard） -----
+# 1バイトごとの立っているビット数（np.bitwise_count がない NumPy 用）
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount_rows(words):
+    """uint64 行列の各行で立っているビットの数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+class PatternSimilarityIndex:
+    """
+    パターンの項目名集合（layout_tokens）を、全パターン共通の項目名辞書の上の
+    ビットセットとして保持し、問い合わせたパターンと Jaccard 類似度の高い
+    登録済みパターンを上位 k 件返す。
+    ビットセットは uint64 の行列で持ち、AND と popcount を全パターン分まとめて計算する。
+    """
+
+    def __init__(self):
+        self.token_ids = {}  # 項目名 -> ビット位置
+        self.names = []      # 行番号 -> パターン名（登録順）
+        self._bits = np.zeros((0, 1), dtype=np.uint64)
+        self._sizes = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_patterns(cls, patterns):
+        """{パターン名: 値リスト} からまとめて作る"""
+        index = cls()
+        for pattern_name, values in patterns.items():
+            index.add(pattern_name, values)
+        return index
+
+    def _bitset(self, tokens):
+        bitset = np.zeros(self._bits.shape[1], dtype=np.uint64)
+        for token in tokens:
+            token_id = self.token_ids.get(token)
+            if token_id is not None:
+                bitset[token_id >> 6] |= np.uint64(1) << np.uint64(token_id & 63)
+        return bitset
+
+    def add(self, pattern_name, values):
+        tokens = layout_tokens(values)
+        for token in tokens:
+            self.token_ids.setdefault(token, len(self.token_ids))
+        rows = len(self.names)
+        capacity, width = self._bits.shape
+        words = max(1, (len(self.token_ids) + 63) // 64)
+        if rows == capacity or words > width:
+            # 行・語数とも倍々に広げ、追加のたびにコピーしないようにする
+            grown = np.zeros((max(capacity * 2, 16) if rows == capacity else capacity,
+                              max(words, width * 2) if words > width else width), dtype=np.uint64)
+            grown[:rows, :width] = self._bits[:rows]
+            sizes = np.zeros(grown.shape[0], dtype=np.int64)
+            sizes[:rows] = self._sizes[:rows]
+            self._bits, self._sizes = grown, sizes
+        self._bits[rows] = self._bitset(tokens)
+        self._sizes[rows] = len(tokens)
+        self.names.append(pattern_name)
+
+    def query(self, values, k=None):
+        """
+        values と Jaccard 類似度の高い登録済みパターンを [(パターン名, 類似度), ...] で返す。
+        類似度の高い順（同じ場合は登録順）で、共通の項目がないパターンは含めない。
+        """
+        if k is None:
+            k = SIMILAR_PATTERN_TOP_K
+        rows = len(self.names)
+        tokens = layout_tokens(values)
+        if k <= 0 or rows == 0 or not tokens:
+            return []
+        # 辞書にない項目名は共通部分には入らないが、和集合の大きさには数える
+        intersections = _popcount_rows(self._bits[:rows] & self._bitset(tokens))
+        similarities = intersections / (self._sizes[:rows] + len(tokens) - intersections)
+        candidates = np.flatnonzero(intersections)
+        if len(candidates) > k:
+            # k 番目の類似度と同点のものは残し、順位は登録順で決める
+            kth = np.partition(similarities[candidates], len(candidates) - k)[len(candidates) - k]
+            candidates = candidates[similarities[candidates] >= kth]
+        order = candidates[np.lexsort((candidates, -similarities[candidates]))][:k]
+        return [(self.names[i], float(similarities[i])) for i in order]
+
+def iter_phase1_scans(file_paths, workers=1, scan_mode='full'):
+    """
+    (scan_file_phase1 の結果, 所要秒数) を file_paths と同じ順序で返す。
+    workers が 2 以上の場合はプロセスプールで並列に読み込むが、
+    結果の順序は入力順のままなのでパターン名の採番は逐次実行と一致する。
+    """
+    scanner = partial(timed_scan_file_phase1, scan_mode)
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield scanner(file_path)
+        return
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(scanner, file_paths, chunksize=chunksize)
+
+def process_phase1(target_path, municipality_name, phase1_output_dir, log_file_path, workers=None, scan_mode=None,
+                   incremental=None):
+    if workers is None:
+        workers = PHASE1_WORKERS
+    if scan_mode is None:
+        scan_mode = PHASE1_SCAN_MODE
+    if incremental is None:
+        incremental = PHASE1_INCREMENTAL
+    jsonl_path = f"{os.path.splitext(log_file_path)[0]}.jsonl" if RUN_LOG_JSONL else None
+    with RunLogger(log_file_path, jsonl_path) as logger:
+        phase_started = time.perf_counter()
+        logger.write(f"\n\n==== Phase1 実行開始: {datetime.now()} ====\nターゲットパス: {target_path}\n")
+    
+        # サブフォルダ内の.xlsxファイルを収集
+        xlsx_files, skipped_count = discover_source_files(target_path)
+    
+        logger.write(f"Found {len(xlsx_files)} xlsx files in target path\n")
+        if skipped_count:
+            logger.write(f"Skipped {skipped_count} Excel lock/temporary files\n")
+    
+        output_data = []       # パターン定義用データ
+        file_pattern_data = [] # ファイル別パターン情報
+        pattern_counter = 0
+        registry = PatternRegistry()
+        similarity_index = PatternSimilarityIndex() if SIMILAR_PATTERN_TOP_K > 0 else None
+        catalog = None
+        catalog_matches = {}  # パターン名 -> (catalog_id, 初出の自治体, 初出のパターン名)
+        if PATTERN_CATALOG_ENABLED:
             try:
-                workbook = load_workbook(file_path, data_only=True)
+                catalog = PatternCatalog(PATTERN_CATALOG_PATH)
             except Exception as e:
-                with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                    log_file.write(f"Failed to load workbook {file_name}: {e}\n")
-                continue
-            sheet = workbook.active
-            merged_cells_cache = cache_merged_cells(sheet)
-            pattern_found = False
-            file_id = None  # ローカルファイルではIDは不要
-            for row in sheet.iter_rows():
-                for cell in row:
-                    cell_value = get_merged_cell_value(sheet, cell, merged_cells_cache)
-                    if cell_value == '返礼品コード':
-                        all_values = get_values_until_last_data(sheet, cell, merged_cells_cache)
-                        existing_pattern_name = find_existing_pattern(all_values)
-                        if existing_pattern_name:
-                            file_pattern_data.append([municipality_name, folder_name, file_name, existing_pattern_name, file_id])
-                        else:
-                            pattern_counter += 1
-                            pattern_name = f"PAT{str(pattern_counter).zfill(4)}"
-                            output_data.append([pattern_name, f"{cell.column_letter}{cell.row}"] + all_values)
-                            file_pattern_data.append([municipality_name, folder_name, file_name, pattern_name, file_id])
-                            existing_patterns[pattern_name] = all_values
-                        pattern_found = True
-                        break
-                if pattern_found:
-                    break
-            if not pattern_found:
-                file_pattern_data.append([municipality_name, folder_name, file_name, 'なし', file_id])
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write(f"File {i+1}/{len(xlsx_files)} processed: {file_name}\n")
-        except Exception as e:
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write(f"Error processing {file_name}: {e}\n")
+                logger.write(f"Failed to open pattern catalog: {e}\n")
+
+        # 前回のマニフェストと内容が変わっていないファイルは読み込まずに前回の結果を使う
+        manifest_path = os.path.join(phase1_output_dir, f"{municipality_name}_manifest.json")
+        previous_manifest = load_phase1_manifest(manifest_path) if incremental else {}
+        file_infos = {}
+        cached_results = {}
+        pending_paths = []
+        for source_file in xlsx_files:
+            file_path = source_file.path
+            try:
+                previous_entry = previous_manifest.get(file_path)
+                file_infos[file_path], reusable = probe_manifest_entry(previous_entry, source_file)
+            except OSError:
+                reusable = False
+            if reusable:
+                cached_results[file_path] = manifest_entry_to_scan_result(previous_entry)
+            else:
+                pending_paths.append(file_path)
+        if incremental:
+            logger.write(f"Unchanged files reused from manifest: {len(cached_results)}, files to read: {len(pending_paths)}\n")
+        # 読み込みはワーカー側で行い、パターン名の採番はファイル順に親プロセスで行う
+        manifest_entries = []
+        pending_results = iter_phase1_scans(pending_paths, workers, scan_mode)
+        for i, source_file in enumerate(xlsx_files):
+            folder_name, file_path, file_name = source_file.folder_name, source_file.path, source_file.name
+            # 読み込み結果は表示・ログより先に取り出す。途中で例外が起きても、
+            # このファイルの結果が次のファイルに割り当てられないようにするため
+            cached = file_path in cached_results
+            if cached:
+                scan_result, scan_seconds = cached_results[file_path], 0.0
+            else:
+                scan_result, scan_seconds = next(pending_results)
+            try:
+                print(f"Processing file: {file_name}")
+                logger.write(f"\nProcessing file: {file_name}\n")
+                status, anchor, result = scan_result
+                logger.record('file', index=i + 1, folder=folder_name, file=file_name, status=status,
+                              cached=cached, seconds=round(scan_seconds, 4))
+                # 読み込み失敗は一時的な原因（ロック中など）もあるため記録しない
+                if status in ('found', 'not_found') and file_path in file_infos:
+                    manifest_entries.append(scan_result_to_manifest_entry(file_infos[file_path], scan_result))
+                if status == 'load_error':
+                    logger.write(f"Failed to load workbook {file_name}: {result}\n")
+                    continue
+                if status == 'error':
+                    raise RuntimeError(result)
+                file_id = None  # ローカルファイルではIDは不要
+                if status == 'found':
+                    all_values = result
+                    pattern_name = registry.lookup(all_values)
+                    if pattern_name is None:
+                        pattern_counter += 1
+                        pattern_name = f"PAT{str(pattern_counter).zfill(4)}"
+                        output_data.append([pattern_name, anchor] + all_values)
+                        registry.register(pattern_name, all_values)
+                        if similarity_index is not None:
+                            similar = similarity_index.query(all_values)
+                            similarity_index.add(pattern_name, all_values)
+                            if similar:
+                                logger.write(f"{pattern_name} に近い既存パターン: "
+                                             + ", ".join(f"{name} ({score:.2f})" for name, score in similar) + "\n")
+                                logger.record('similar_patterns', pattern=pattern_name,
+                                              matches=[[name, round(score, 4)] for name, score in similar])
+                        if catalog is not None:
+                            catalog_id, known = catalog.register(all_values, anchor, municipality_name, pattern_name)
+                            if known is None:
+                                catalog_matches[pattern_name] = (catalog_id, municipality_name, pattern_name)
+                            else:
+                                catalog_matches[pattern_name] = known
+                                logger.write(f"{pattern_name} は既知のパターン {PatternCatalog.format_id(known[0])}"
+                                             f"（初出: {known[1]} {known[2]}）\n")
+                    file_pattern_data.append([municipality_name, folder_name, file_name, pattern_name, file_id])
+                    registry.record_file(pattern_name)
+                else:
+                    file_pattern_data.append([municipality_name, folder_name, file_name, 'なし', file_id])
+                logger.write(f"File {i+1}/{len(xlsx_files)} processed: {file_name}\n")
+            except Exception as e:
+                logger.write(f"Error processing {file_name}: {e}\n")
+
+        if catalog is not None:
+            try:
+                catalog.record_usage(municipality_name,
+                                     {name: match[0] for name, match in catalog_matches.items()},
+                                     registry.counts)
+                catalog.connection.commit()
+            except Exception as e:
+                logger.write(f"Failed to update pattern catalog: {e}\n")
+            finally:
+                catalog.connection.close()
+
+        if incremental:
+            try:
+                save_phase1_manifest(manifest_path, manifest_entries)
+            except Exception as e:
+                logger.write(f"Failed to save manifest: {e}\n")
     
-    if output_data:
-        max_columns = max([len(row) for row in output_data])
-        column_names = ['パターン名', 'A1形式'] + [f'列の値_{i}' for i in range(1, max_columns - 1)]
-        output_df = pd.DataFrame(output_data, columns=column_names)
-        file_pattern_df = pd.DataFrame(file_pattern_data, columns=['自治体', 'フォルダ名', 'ファイル名', 'パターン名', 'ファイルID'])
-        output_path = os.path.join(phase1_output_dir, f"{municipality_name}_パターン一覧.xlsx")
-        try:
-            output_df.to_excel(output_path, index=False)
-        except Exception as e:
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write(f"Failed to save output Excel file: {e}\n")
-        file_pattern_output_path = os.path.join(phase1_output_dir, f"{municipality_name}_ファイル別パターン.xlsx")
-        try:
-            file_pattern_df.to_excel(file_pattern_output_path, index=False)
-        except Exception as e:
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write(f"Failed to save file pattern Excel file: {e}\n")
-        with open(log_file_path, 'a', encoding='utf-8') as log_file:
-            log_file.write(f"\nResults saved to: {output_path}\nFile patterns saved to: {file_pattern_output_path}\n")
-            log_file.write(f"==== Phase1 実行終了: {datetime.now()} ====\n\n")
+        if output_data:
+            max_columns = max([len(row) for row in output_data])
+            column_names = ['パターン名', 'A1形式'] + [f'列の値_{i}' for i in range(1, max_columns - 1)]
+            output_df = pd.DataFrame(output_data, columns=column_names)
+            file_pattern_df = pd.DataFrame(file_pattern_data, columns=['自治体', 'フォルダ名', 'ファイル名', 'パターン名', 'ファイルID'])
+            output_path = os.path.join(phase1_output_dir, f"{municipality_name}_パターン一覧.xlsx")
+            try:
+                write_excel_with_sidecar(output_df, output_path, index=False)
+            except Exception as e:
+                logger.write(f"Failed to save output Excel file: {e}\n")
+            file_pattern_output_path = os.path.join(phase1_output_dir, f"{municipality_name}_ファイル別パターン.xlsx")
+            try:
+                write_excel_with_sidecar(file_pattern_df, file_pattern_output_path, index=False)
+            except Exception as e:
+                logger.write(f"Failed to save file pattern Excel file: {e}\n")
+            # パターンごとのファイル数（同じレイアウトを共有するファイルの件数）
+            pattern_count_df = pd.DataFrame(list(registry.counts.items()), columns=['パターン名', 'ファイル数'])
+            clusters = cluster_near_duplicate_patterns(registry.patterns)
+            pattern_count_df['類似クラスタ'] = [clusters[name] for name in pattern_count_df['パターン名']]
+            if catalog_matches:
+                pattern_count_df['カタログID'] = [
+                    PatternCatalog.format_id(catalog_matches[name][0]) if name in catalog_matches else ""
+                    for name in pattern_count_df['パターン名']]
+                pattern_count_df['初出自治体'] = [
+                    catalog_matches[name][1] if name in catalog_matches else ""
+                    for name in pattern_count_df['パターン名']]
+            pattern_count_output_path = os.path.join(phase1_output_dir, f"{municipality_name}_パターン別ファイル数.xlsx")
+            try:
+                pattern_count_df.to_excel(pattern_count_output_path, index=False)
+            except Exception as e:
+                logger.write(f"Failed to save pattern count Excel file: {e}\n")
+            logger.write("\nFiles per pattern:\n")
+            for pattern_name, count in registry.counts.items():
+                logger.write(f"  {pattern_name}: {count}\n")
+            cluster_count = len(set(clusters.values()))
+            logger.write(f"\nNear-duplicate layout clusters: {cluster_count} (patterns: {len(clusters)})\n")
+            for pattern_name, representative in clusters.items():
+                if pattern_name != representative:
+                    logger.write(f"  {pattern_name} -> {representative}\n")
+            logger.write(f"\nResults saved to: {output_path}\nFile patterns saved to: {file_pattern_output_path}\n")
+            logger.write(f"Pattern counts saved to: {pattern_count_output_path}\n")
+            logger.write(f"==== Phase1 実行終了: {datetime.now()} ====\n\n")
+        logger.record('phase1', files=len(xlsx_files), patterns=len(registry), reused=len(cached_results),
+                      seconds=round(time.perf_counter() - phase_started, 4))
 
 # ===== Phase2: パターン一覧_Phase2.xlsx 作成 =====
-def process_phase2(municipality_name, phase1_output_dir, phase2_output_dir):
+PHASE2_STATE_VERSION = 3
+
+def load_phase2_state(state_path):
+    """
+    前回の Phase2 の入力・出力の指紋を読み込む（JSON。共有ドライブ上に置くため pickle は使わない）。
+    存在しない・壊れている・形式が古い場合は None
+    """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(stored, dict) or stored.get('version') != PHASE2_STATE_VERSION \
+            or not isinstance(stored.get('fingerprints'), dict):
+        return None
+    return stored
+
+def save_phase2_state(state_path, fingerprints):
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': PHASE2_STATE_VERSION, 'fingerprints': fingerprints}, f, ensure_ascii=False)
+    os.replace(temp_path, state_path)
+
+def phase2_fingerprints(input_file, output_file, index_path):
+    """Phase2 の入力・出力の指紋。読めないファイルがあれば None"""
+    try:
+        return {'input': workbook_fingerprint(input_file), 'output': workbook_fingerprint(output_file),
+                'index': file_content_hash(index_path)}
+    except OSError:
+        return None
+
+class PatternHeaderIndex:
+    """
+    パターン × 見出しの疎な対応表（CSR 形式）。Phase2 で作成し .npz で保存する。
+    行（パターン）ごとの見出し番号を indices[indptr[i]:indptr[i + 1]] に持ち、
+    見出しごとのパターン一覧は読み込み時に転置（CSC）して持つ。
+    """
+
+    def __init__(self, patterns, headers, indptr, indices, fill_counts):
+        self.patterns = [str(pattern) for pattern in patterns]
+        self.headers = [str(header) for header in headers]
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.fill_counts = np.asarray(fill_counts, dtype=np.int64)
+        # 同名のパターンが複数ある場合は、パターン一覧で先の行を使う
+        self._pattern_ids = {}
+        for i, pattern in enumerate(self.patterns):
+            self._pattern_ids.setdefault(pattern, i)
+        self._header_ids = {header: i for i, header in enumerate(self.headers)}
+        row_ids = np.repeat(np.arange(len(self.patterns), dtype=np.int32), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        self._header_pattern_ids = row_ids[order]
+        self._header_indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.indices, minlength=len(self.headers)))]).astype(np.int64)
+
+    @classmethod
+    def from_mask(cls, patterns, headers, mask, fill_counts):
+        """mask[i, j] が True ならパターン i が見出し j を含む"""
+        row_ids, col_ids = np.nonzero(mask)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(row_ids, minlength=len(patterns)))])
+        return cls(patterns, headers, indptr, col_ids, fill_counts)
+
+    def save(self, path):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, patterns=np.array(self.patterns, dtype=str), headers=np.array(self.headers, dtype=str),
+                     indptr=self.indptr, indices=self.indices, fill_counts=self.fill_counts)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(npz['patterns'].tolist(), npz['headers'].tolist(), npz['indptr'], npz['indices'],
+                       npz['fill_counts'])
+
+    def headers_of(self, pattern_name):
+        """パターンが含む見出しのリスト（見出しの登録順）"""
+        i = self._pattern_ids.get(pattern_name)
+        if i is None:
+            return []
+        return [self.headers[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def patterns_with(self, header):
+        """見出しを含むパターン名のリスト（パターン一覧の順）"""
+        j = self._header_ids.get(header)
+        if j is None:
+            return []
+        return [self.patterns[i] for i in self._header_pattern_ids[self._header_indptr[j]:self._header_indptr[j + 1]]]
+
+    def fill_count(self, header):
+        """見出しを含むパターン数"""
+        j = self._header_ids.get(header)
+        return 0 if j is None else int(self.fill_counts[j])
+
+def pattern_header_index_path(phase2_output_dir, municipality_name):
+    return os.path.join(phase2_output_dir, f"{municipality_name}_pattern_headers.npz")
+
+def process_phase2(municipality_name, phase1_output_dir, phase2_output_dir, incremental=None):
+    if incremental is None:
+        incremental = PHASE2_INCREMENTAL
     input_file = os.path.join(phase1_output_dir, f"{municipality_name}_パターン一覧.xlsx")
     output_file = os.path.join(phase2_output_dir, f"{municipality_name}_パターン一覧_Phase2.xlsx")
-    df = pd.read_excel(input_file, sheet_name="Sheet1", header=None)
+    state_path = os.path.join(phase2_output_dir, f"{municipality_name}_phase2_state.json")
+    index_path = pattern_header_index_path(phase2_output_dir, municipality_name)
+    state = load_phase2_state(state_path) if incremental else None
+    if state is not None and state['fingerprints'] \
+            and phase2_fingerprints(input_file, output_file, index_path) == state['fingerprints']:
+        # パターン一覧が前回と同じで、出力も手を加えられていなければ、そのまま使う
+        print("Phase2: パターン一覧と前回の出力に変更がないため、書き込みを省略します。")
+        print(f"Phase2 の処理が完了しました。\n出力ファイル: {output_file}")
+        return
+    df = read_excel_with_sidecar(input_file, sheet_name="Sheet1", header=None)
     df = df.fillna("")
-    data = df.values.tolist()
-    data = [row for row in data if str(row[0]).strip() != ""]
+    data = df.to_numpy(dtype=object)
+    # str(セル).strip() は全セル分を一度だけ計算し、以降の判定はこの配列で行う
+    # （np.char は最長のセルに合わせた固定長の配列を作るため、object のまま要素ごとに処理する）
+    text = np.frompyfunc(lambda value: str(value).strip(), 1, 1)(data)
+    keep = text[:, 0] != "" if text.size else np.zeros(len(data), dtype=bool)
+    data, text = data[keep], text[keep]
     last_row = len(data)
     if last_row == 0:
         raise ValueError("入力ファイルにデータがありません。")
-    total_columns = len(data[0])
-    unique_headers = {}
-    header_order = []
-    for col in range(total_columns - 1, 1, -1):
-        for r in range(1, last_row):
-            cell_value = str(data[r][col]).strip()
-            if cell_value != "":
-                if cell_value not in unique_headers:
-                    unique_headers[cell_value] = True
-                    header_order.append(cell_value)
-    headers = header_order[::-1]
-    new_data = []
-    new_header_row = [data[0][0], data[0][1]] + headers
-    new_data.append(new_header_row)
-    for r in range(1, last_row):
-        new_row = [data[r][0], data[r][1]]
-        row_data = {}
-        for cell in data[r]:
-            cell_str = str(cell).strip()
-            if cell_str != "":
-                row_data[cell_str] = cell_str
-        for h in headers:
-            new_row.append(row_data.get(h, ""))
-        new_data.append(new_row)
-    for i, row in enumerate(new_data):
-        if i == 0:
-            row.insert(2, "返礼品コード")
-        else:
-            if isinstance(row[0], str) and row[0].startswith("PAT"):
-                row.insert(2, "返礼品コード")
-            else:
-                row.insert(2, "")
-    num_rows = len(new_data)
-    num_cols = len(new_data[0])
-    col_counts = []
-    for col in range(num_cols):
-        count = sum(1 for row in new_data[1:] if str(row[col]).strip() != "")
-        col_counts.append((col, count))
-    col_counts_sorted = sorted(col_counts, key=lambda x: x[1], reverse=True)
-    reordered_data = []
-    for row in new_data:
-        new_row = [row[col_index] for col_index, _ in col_counts_sorted]
-        reordered_data.append(new_row)
+    body = text[1:]
+    # 見出しは最終列から3列目へ、各列は上の行から走査した初出順を逆にしたもの
+    scan_order = body[:, :1:-1].T.ravel()
+    headers = list(pd.unique(scan_order[scan_order != ""]))[::-1]
+    # 各行について、行内（先頭2列を含む）に現れる見出しの列にその見出しを入れる
+    header_codes = pd.Index(headers, dtype=object).get_indexer(body.ravel()).reshape(body.shape)
+    header_values = np.array(headers + [""], dtype=object)
+    filled = np.full((last_row - 1, len(headers)), "", dtype=object)
+    row_ids, col_ids = np.nonzero(header_codes >= 0)
+    codes = header_codes[row_ids, col_ids]
+    filled[row_ids, codes] = header_values[codes]
+    gift_code = np.array(["返礼品コード" if isinstance(name, str) and name.startswith("PAT") else ""
+                          for name in data[1:, 0]], dtype=object)
+    new_data = np.empty((last_row, 3 + len(headers)), dtype=object)
+    new_data[0] = [data[0, 0], data[0, 1], "返礼品コード"] + headers
+    new_data[1:, 0] = data[1:, 0]
+    new_data[1:, 1] = data[1:, 1]
+    new_data[1:, 2] = gift_code
+    new_data[1:, 3:] = filled
+    # 値のある行数の多い順に列を並べ替える（同数なら元の順）
+    col_counts = np.concatenate([
+        [np.count_nonzero(body[:, 0] != ""), np.count_nonzero(body[:, 1] != ""), np.count_nonzero(gift_code != "")],
+        np.count_nonzero(filled != "", axis=0),
+    ])
+    reordered_data = new_data[:, np.argsort(-col_counts, kind='stable')].tolist()
     output_df = pd.DataFrame(reordered_data)
-    output_df.to_excel(output_file, index=False, header=False)
+    write_excel_with_sidecar(output_df, output_file, index=False, header=False)
+    index_saved = False
+    try:
+        PatternHeaderIndex.from_mask(body[:, 0], headers, filled != "", col_counts[3:]).save(index_path)
+        index_saved = True
+    except OSError as e:
+        print(f"パターン×見出しの対応表の保存に失敗: {e}")
+    if incremental:
+        # 対応表を保存できなかった場合は、次回も書き込みを省略しない
+        fingerprints = (phase2_fingerprints(input_file, output_file, index_path) if index_saved else None) or {}
+        try:
+            save_phase2_state(state_path, fingerprints)
+        except OSError as e:
+            print(f"Phase2 の集計結果の保存に失敗: {e}")
     print(f"Phase2 の処理が完了しました。\n出力ファイル: {output_file}")
 
 # ===== Phase3: 各ファイルの転置処理 =====
+FileListEntry = namedtuple('FileListEntry', ['municipality', 'folder_name', 'file_name', 'pattern_name'])
+
+def _column_strings(values):
+    """
+    1列分の値をまとめて str() → strip() した object 配列を返す。
+    行ごとの str(value).strip() と同じ文字列になる（欠損値は 'nan'）。
+    """
+    return pd.Series(values, dtype=object).map(str).str.strip().to_numpy(dtype=object)
+
 def load_pattern_map(def_file, sheet_name="Sheet1"):
+    """
+    パターン定義シートを読み込み、{パターン名: キーワードのタプル} を返す。
+    タプルは定義シートの2列目以降の並びで、欠損セルは空文字、
+    "キーワード_" の接頭辞は取り除く。処理は列単位でまとめて行う。
+    """
     try:
-        df = pd.read_excel(def_file, sheet_name=sheet_name)
+        df = read_excel_with_sidecar(def_file, sheet_name=sheet_name)
     except Exception as e:
         print(f"パターン定義シートの読み込みに失敗: {e}")
         return {}
-    pattern_map = {}
     if df.empty:
-        return pattern_map
-    pattern_col = df.columns[0]
-    output_cols = list(df.columns[1:])
-    for idx, row in df.iterrows():
-        pattern_name = str(row[pattern_col]).strip() if pd.notna(row[pattern_col]) else ""
-        if not pattern_name:
-            continue
-        mapping = {}
-        for col in output_cols:
-            cell_val = row[col]
-            if pd.notna(cell_val):
-                keyword = str(cell_val).strip()
-                if keyword.startswith("キーワード_"):
-                    keyword = keyword.replace("キーワード_", "")
-            else:
-                keyword = ""
-            mapping[col] = keyword
-        pattern_map[pattern_name] = mapping
-    return pattern_map
+        return {}
+    # 行単位で読んでいた頃と同じ値になるよう、DataFrame 全体の共通 dtype で取り出す
+    table = df.to_numpy()
+    names = np.where(pd.notna(table[:, 0]), _column_strings(table[:, 0]), "")
+    keyword_columns = []
+    for position in range(1, table.shape[1]):
+        column = table[:, position]
+        keywords = pd.Series(_column_strings(column), dtype=object)
+        prefixed = keywords.str.startswith("キーワード_").to_numpy(dtype=bool)
+        if prefixed.any():
+            keywords[prefixed] = keywords[prefixed].str.replace("キーワード_", "", regex=False)
+        keyword_columns.append(np.where(pd.notna(column), keywords.to_numpy(dtype=object), ""))
+    keywords_by_row = zip(*keyword_columns) if keyword_columns else [()] * len(df)
+    return {name: keywords for name, keywords in zip(names.tolist(), keywords_by_row) if name}
 
 def load_file_list(list_file, sheet_name="Sheet1"):
+    """
+    ファイル一覧シートを読み込み、FileListEntry のリストを返す。
+    各項目は列単位で str() → strip() 済み。必要な列が無い場合は None。
+    """
     try:
-        df = pd.read_excel(list_file, sheet_name=sheet_name)
+        df = read_excel_with_sidecar(list_file, sheet_name=sheet_name)
     except Exception as e:
         print(f"ファイル一覧シートの読み込みに失敗: {e}")
         return None
@@ -262,11 +1931,50 @@ def load_file_list(list_file, sheet_name="Sheet1"):
         if col not in df.columns:
             print(f"必要な列 '{col}' がファイル一覧にありません。")
             return None
-    return df
+    table = df[required_columns].to_numpy()
+    columns = [_column_strings(table[:, position]).tolist() for position in range(len(required_columns))]
+    return [FileListEntry._make(values) for values in zip(*columns)]
+
+class StyleInterner:
+    """
+    転置先ワークブックでのスタイルの共有。
+    元セルのスタイルの組 (font, border, fill, number_format, protection, alignment) ごとに
+    転置先のスタイル表へは1度だけ登録し、その StyleArray（スタイル表の添字の組）を覚えておく。
+    以降の同じ組のセルには添字をコピーするだけなので、スタイルオブジェクトの複製と
+    スタイル表の検索（ハッシュ計算）がセルごとには発生しない。
+    """
+
+    def __init__(self):
+        self._arrays = {}  # スタイルの組 -> 転置先の StyleArray
+
+    def __len__(self):
+        return len(self._arrays)
 
-def process_file_phase3(file_path, combined_ws, start_output_row):
-    wb = load_workbook(file_path)
-    ws = wb.active
+    def apply(self, source_cell, target_cell):
+        """source_cell のスタイルを target_cell に設定し、設定した StyleArray を返す"""
+        style = (copy(source_cell.font), copy(source_cell.border), copy(source_cell.fill),
+                 copy(source_cell.number_format), copy(source_cell.protection), copy(source_cell.alignment))
+        style_array = self._arrays.get(style)
+        if style_array is None:
+            (target_cell.font, target_cell.border, target_cell.fill,
+             target_cell.number_format, target_cell.protection, target_cell.alignment) = style
+            style_array = self._arrays[style] = copy(target_cell._style)
+        else:
+            target_cell._style = copy(style_array)
+        return style_array
+
+def process_file_phase3(file_path, combined_ws, start_output_row, style_interner=None, values_only=False):
+    """
+    file_path の表を転置して combined_ws の start_output_row 行目から書き込み、書き込んだ行数を返す。
+    style_interner を転置先ワークブックごとに共有すると、スタイルの登録がブック全体で1度ずつになる。
+    values_only の場合は値（数式は数式のまま）と結合範囲だけを転置し、元ファイルのスタイルは読まない。
+    """
+    if style_interner is None:
+        style_interner = StyleInterner()
+    if values_only:
+        ws = load_active_sheet(file_path, light=True)
+    else:
+        ws = load_active_sheet(file_path, with_styles=True)
     start_cell = None
     for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
         for cell in row:
@@ -286,13 +1994,13 @@ def process_file_phase3(file_path, combined_ws, start_output_row):
     if not start_cell:
         raise ValueError(f'"No." または "項目" が {file_path} 内に見つかりませんでした。')
     start_row, start_col = start_cell.row, start_cell.column
+    merged_index = MergedCellIndex.from_sheet(ws, with_values=False)
     end_col_candidate = None
     if start_cell.value == "項目":
-        for merged_range in ws.merged_cells.ranges:
-            if start_cell.coordinate in merged_range:
-                start_col = merged_range.min_col
-                end_col_candidate = merged_range.max_col
-                break
+        bounds = merged_index.find(start_cell.row, start_cell.column)
+        if bounds is not None:
+            start_col = bounds[1]
+            end_col_candidate = bounds[3]
     end_row = start_row
     for r in range(start_row, ws.max_row + 1):
         if any(ws.cell(row=r, column=c).value is not None for c in range(start_col, ws.max_column + 1)):
@@ -305,29 +2013,29 @@ def process_file_phase3(file_path, combined_ws, start_output_row):
         end_col = end_col_candidate
     orig_rows = end_row - start_row + 1
     orig_cols = end_col - start_col + 1
+    local_styles = {}  # 元シートでのスタイルの番号 -> 転置先の StyleArray
     for r_idx, r in enumerate(range(start_row, end_row + 1), start=1):
         for c_idx, c in enumerate(range(start_col, end_col + 1), start=1):
             orig_cell = ws.cell(row=r, column=c)
             final_row = start_output_row + (c_idx - 1)
             final_col = r_idx + 1
             new_cell = combined_ws.cell(row=final_row, column=final_col, value=orig_cell.value)
-            if orig_cell.has_style:
-                new_cell.font = copy(orig_cell.font)
-                new_cell.border = copy(orig_cell.border)
-                new_cell.fill = copy(orig_cell.fill)
-                new_cell.number_format = copy(orig_cell.number_format)
-                new_cell.protection = copy(orig_cell.protection)
-                new_cell.alignment = copy(orig_cell.alignment)
+            if not values_only and orig_cell.has_style:
+                style_array = local_styles.get(orig_cell.style_id)
+                if style_array is None:
+                    local_styles[orig_cell.style_id] = style_interner.apply(orig_cell, new_cell)
+                else:
+                    new_cell._style = copy(style_array)
     filename = file_path  # フルパスを使用
     for offset in range(orig_cols):
         combined_ws.cell(row=start_output_row + offset, column=1, value=filename)
-    for merged_range in ws.merged_cells.ranges:
-        if (merged_range.min_row >= start_row and merged_range.max_row <= end_row and
-            merged_range.min_col >= start_col and merged_range.max_col <= end_col):
-            new_start_row = merged_range.min_col - start_col + 1
-            new_start_col = merged_range.min_row - start_row + 1
-            new_end_row = merged_range.max_col - start_col + 1
-            new_end_col = merged_range.max_row - start_row + 1
+    for min_row, min_col, max_row, max_col in merged_index.ranges:
+        if (min_row >= start_row and max_row <= end_row and
+            min_col >= start_col and max_col <= end_col):
+            new_start_row = min_col - start_col + 1
+            new_start_col = min_row - start_row + 1
+            new_end_row = max_col - start_col + 1
+            new_end_col = max_row - start_row + 1
             final_start_row = start_output_row + new_start_row - 1
             final_start_col = new_start_col + 1  # A列はファイル名用
             final_end_row = start_output_row + new_end_row - 1
@@ -336,7 +2044,173 @@ def process_file_phase3(file_path, combined_ws, start_output_row):
                                       end_row=final_end_row, end_column=final_end_col)
     return orig_cols
 
-def process_phase3():
+class IoThrottle:
+    """
+    Phase3 で共有ドライブ上のファイルを読む間隔を調整する。
+      - rate が正の場合、1秒あたり rate 件までのトークンバケットで間隔を空ける
+      - 読み込みの失敗（OSError）や所要時間の急増を観測したときだけ待ち時間を
+        倍々に延ばし（max_delay まで）、正常な読み込みが続けば半分ずつ戻す
+    急増は直近の成功した読み込みの所要時間の中央値と比べて判定する。
+    実際に待った秒数の合計を throttled_seconds に持つ。
+    """
+    INITIAL_BACKOFF = 1.0
+    MIN_SPIKE_SECONDS = 0.5  # これより短い読み込みは急増とみなさない
+    LATENCY_WINDOW = 20      # 中央値を取る直近の所要時間の件数
+
+    def __init__(self, rate=None, max_delay=None, spike_factor=None):
+        self.rate = PHASE3_IO_RATE if rate is None else rate
+        self.max_delay = PHASE3_THROTTLE_MAX_SECONDS if max_delay is None else max_delay
+        self.spike_factor = PHASE3_LATENCY_SPIKE_FACTOR if spike_factor is None else spike_factor
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.backoff = 0.0
+        self.recent_seconds = deque(maxlen=self.LATENCY_WINDOW)
+        self.throttled_seconds = 0.0
+        self.backoff_count = 0
+        self._last_refill = time.monotonic()
+
+    def wait(self):
+        """次のファイルを読む前に呼ぶ。必要な分だけ待つ"""
+        delay = self.backoff
+        if self.rate > 0:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self.tokens < 1:
+                delay = max(delay, (1 - self.tokens) / self.rate)
+        if delay > 0:
+            time.sleep(delay)
+            self.throttled_seconds += delay
+            if self.rate > 0:
+                self.tokens = min(self.capacity, self.tokens + delay * self.rate)
+                self._last_refill = time.monotonic()
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def observe(self, seconds, error=None):
+        """
+        ファイル1件の読み込み結果（所要秒数と例外）を反映する。キャッシュから読んだファイルは渡さない。
+        成功した読み込みは急増と判定したものも直近の所要時間に加えるため、
+        共有ドライブが遅い状態が続けば基準の中央値も上がり、減速し続けることはない。
+        """
+        spike = (len(self.recent_seconds) > 0 and seconds >= self.MIN_SPIKE_SECONDS
+                 and seconds > statistics.median(self.recent_seconds) * self.spike_factor)
+        if isinstance(error, OSError) or spike:
+            self.backoff = min(self.max_delay, max(self.backoff * 2, self.INITIAL_BACKOFF))
+            self.backoff_count += 1
+        else:
+            self.backoff = self.backoff / 2 if self.backoff >= 0.1 else 0.0
+        if error is None:
+            self.recent_seconds.append(seconds)
+
+class StreamingPatternSheet:
+    """
+    Phase3 の転置ブロックを write-only のワークブックへ1ファイル分ずつ書き出す。
+    process_file_phase3 には1ファイル分だけの作業用シート（通常の Worksheet）を渡し、
+    cell() / merge_cells() で書き込んだ結果を行単位で append して捨てるため、
+    保持するのはパターンのファイル数によらず1ファイル分のセルと結合範囲の一覧だけになる。
+    結合範囲の処理（隠れたセルの消去・罫線の補完）は作業用シート上で openpyxl が行うので、
+    保存される内容は通常のシートに書き込んだ場合と同じになる。
+    """
+
+    def __init__(self):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.rows_written = 0
+
+    def new_block(self):
+        """1ファイル分の作業用シート（スタイルはこのワークブックと共有する）"""
+        return Worksheet(self.workbook)
+
+    def append_block(self, block, row_count):
+        """作業用シートの 1〜row_count 行目を書き出し、結合範囲を出力位置にずらして登録する"""
+        offset = self.rows_written
+        max_col = max((col for _, col in block._cells), default=0)
+        for row in range(1, row_count + 1):
+            values = []
+            for col in range(1, max_col + 1):
+                cell = block._cells.get((row, col))
+                if cell is None or (cell._value is None and not cell.has_style):
+                    values.append(None)
+                    continue
+                out = WriteOnlyCell(self.sheet)
+                out._value = cell._value
+                out.data_type = cell.data_type
+                if cell.has_style:
+                    out._style = copy(cell._style)
+                values.append(out)
+            self.sheet.append(values)
+        for merged in block.merged_cells.ranges:
+            # ブロックどうしは重ならないため、重複確認（範囲数に比例）を省いて直接追加する
+            self.sheet.merged_cells.ranges.add(CellRange(
+                min_col=merged.min_col, min_row=merged.min_row + offset,
+                max_col=merged.max_col, max_row=merged.max_row + offset))
+        self.rows_written += row_count
+
+    def save(self, xlsx_path):
+        self.workbook.save(xlsx_path)
+        # 前回の出力のサイドカーが残っていれば削除する（指紋が合わず使われることはない）
+        try:
+            os.remove(sidecar_path(xlsx_path))
+        except OSError:
+            pass
+
+def build_pattern_book_phase3(pattern_name, file_paths, output_dir, throttle=None, streaming=None, values_only=False):
+    """
+    1パターン分のファイルを file_paths の順に転置して {パターン名}.xlsx に保存する。
+    パターンどうしは独立しているため、Phase3 ではこの単位でワーカーに割り当てる。
+    (読み込んだファイル数, この呼び出しで待った秒数, 減速回数) を返す。
+    """
+    if throttle is None:
+        throttle = IoThrottle()
+    if streaming is None:
+        streaming = PHASE3_STREAMING_WRITE
+    style_interner = StyleInterner()
+    throttled_before, backoffs_before = throttle.throttled_seconds, throttle.backoff_count
+    if streaming:
+        stream = StreamingPatternSheet()
+    else:
+        wb = Workbook()
+        ws = wb.active
+    current_row = 1
+    cache = get_sheet_cache()
+    for file_path in file_paths:
+        # 共有ドライブの負荷に応じて読み込みの間隔を空ける（固定の待ち時間は入れない）
+        throttle.wait()
+        cache_hits_before = cache.hits if cache is not None else 0
+        read_started = time.perf_counter()
+        try:
+            if streaming:
+                block = stream.new_block()
+                block_rows = process_file_phase3(file_path, block, 1, style_interner, values_only)
+                stream.append_block(block, block_rows)
+            else:
+                block_rows = process_file_phase3(file_path, ws, current_row, style_interner, values_only)
+            current_row += block_rows
+        except Exception as e:
+            throttle.observe(time.perf_counter() - read_started, e)
+            print(f"  → {file_path} の処理に失敗: {e}")
+            continue
+        # キャッシュから読んだファイルは共有ドライブの読み込み時間を表さないため反映しない
+        if cache is None or cache.hits == cache_hits_before:
+            throttle.observe(time.perf_counter() - read_started)
+    output_file = os.path.join(output_dir, f"{pattern_name}.xlsx")
+    try:
+        if streaming:
+            stream.save(output_file)
+        else:
+            save_workbook_with_sidecar(wb, output_file)
+        print(f"パターン【{pattern_name}】の転置データを保存しました: {output_file}")
+    except Exception as e:
+        print(f"パターン【{pattern_name}】の保存に失敗: {e}")
+    return (len(file_paths), throttle.throttled_seconds - throttled_before,
+            throttle.backoff_count - backoffs_before)
+
+def process_phase3(workers=None, values_only=None):
+    if workers is None:
+        workers = PHASE3_WORKERS
+    if values_only is None:
+        values_only = PHASE3_VALUES_ONLY == '1'
     start_time = datetime.now()
     print(f"Phase3 処理開始: {start_time}")
     # Phase2のパターン一覧ファイルをパターン定義として、Phase1のファイル別パターンを元に処理
@@ -346,16 +2220,13 @@ def process_phase3():
     if not pattern_map:
         print("パターン定義が空または読み込みに失敗しています。")
         return
-    file_list_df = load_file_list(file_list_file, sheet_name="Sheet1")
-    if file_list_df is None:
+    file_list = load_file_list(file_list_file, sheet_name="Sheet1")
+    if file_list is None:
         print("ファイル一覧が空または読み込みに失敗しています。")
         return
-    pattern_books = {}
-    for idx, row in file_list_df.iterrows():
-        municipality = str(row["自治体"]).strip()
-        folder_name = str(row["フォルダ名"]).strip()
-        file_name = str(row["ファイル名"]).strip()
-        pattern_name = str(row["パターン名"]).strip()
+    # ファイル一覧をパターン名ごとに分ける（パターン内の順序はファイル一覧の順のまま）
+    pattern_files = {}
+    for municipality, folder_name, file_name, pattern_name in file_list:
         print(f"処理中: {folder_name}\\{file_name}  パターン: {pattern_name}")
         if pattern_name == "なし":
             continue
@@ -366,30 +2237,42 @@ def process_phase3():
         if not os.path.exists(file_path):
             print(f"  → ファイルが見つかりません: {file_path}")
             continue
-        if pattern_name not in pattern_books:
-            new_wb = Workbook()
-            new_ws = new_wb.active
-            pattern_books[pattern_name] = {"wb": new_wb, "ws": new_ws, "current_row": 1}
-        else:
-            new_wb = pattern_books[pattern_name]["wb"]
-            new_ws = pattern_books[pattern_name]["ws"]
-        current_row = pattern_books[pattern_name]["current_row"]
-        try:
-            block_rows = process_file_phase3(file_path, new_ws, current_row)
-            pattern_books[pattern_name]["current_row"] = current_row + block_rows
-        except Exception as e:
-            print(f"  → {file_path} の処理に失敗: {e}")
-            continue
-        time.sleep(1)
-    for pattern_name, book_info in pattern_books.items():
-        output_file = os.path.join(PHASE3_OUTPUT_DIR, f"{pattern_name}.xlsx")
-        try:
-            book_info["wb"].save(output_file)
-            print(f"パターン【{pattern_name}】の転置データを保存しました: {output_file}")
-        except Exception as e:
-            print(f"パターン【{pattern_name}】の保存に失敗: {e}")
+        pattern_files.setdefault(pattern_name, []).append(file_path)
+    if workers <= 1 or len(pattern_files) <= 1:
+        workers = 1
+        throttle = IoThrottle()
+        results = [build_pattern_book_phase3(pattern_name, file_paths, PHASE3_OUTPUT_DIR, throttle,
+                                             values_only=values_only)
+                   for pattern_name, file_paths in pattern_files.items()]
+    else:
+        # ファイル数の多いパターンから割り当て、最後に大きなパターンだけが残らないようにする
+        jobs = sorted(pattern_files.items(), key=lambda item: len(item[1]), reverse=True)
+        workers = min(workers, len(jobs))
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(build_pattern_book_phase3, pattern_name, file_paths, PHASE3_OUTPUT_DIR,
+                                       IoThrottle(rate=PHASE3_IO_RATE / workers), values_only=values_only): pattern_name
+                       for pattern_name, file_paths in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"パターン【{futures[future]}】の処理に失敗: {e}")
+    read_count = sum(result[0] for result in results)
+    throttled_seconds = sum(result[1] for result in results)
+    backoff_count = sum(result[2] for result in results)
     end_time = datetime.now()
-    print(f"Phase3 処理終了: {end_time}  経過時間: {end_time - start_time}")
+    jsonl_path = f"{os.path.splitext(LOG_FILE_PATH)[0]}.jsonl" if RUN_LOG_JSONL else None
+    with RunLogger(LOG_FILE_PATH, jsonl_path) as logger:
+        logger.write(f"\n==== Phase3 実行終了: {end_time} ====\n"
+                     f"Files read: {read_count}, patterns: {len(pattern_files)}, workers: {workers}, "
+                     f"values only: {values_only}, "
+                     f"throttled: {throttled_seconds:.1f}s (backoffs: {backoff_count})\n")
+        logger.record('phase3', files=read_count, patterns=len(pattern_files), workers=workers,
+                      values_only=values_only, throttled_seconds=round(throttled_seconds, 4), backoffs=backoff_count,
+                      seconds=round((end_time - start_time).total_seconds(), 4))
+    print(f"Phase3 処理終了: {end_time}  経過時間: {end_time - start_time}"
+          f"  待機時間: {throttled_seconds:.1f}秒")
 
 import os
 from openpyxl import load_workbook, Workbook
@@ -440,8 +2323,14 @@ def combine_rows(row1, row2, col_count):
 
 def process_file_phase4(file_path, output_path):
     # data_only=True でワークブックを読み込み、計算結果（値のみ）を取得
-    wb = load_workbook(file_path, data_only=True)
-    ws = wb.active
+    # Phase3 のサイドカーがあれば xlsx は読まない
+    ws = load_sidecar_grid(file_path)
+    if ws is None:
+        if LIGHT_XLSX_LOADER:
+            ws = read_sheet_values(file_path)
+        else:
+            wb = load_workbook(file_path, data_only=True)
+            ws = wb.active
 
     max_row = ws.max_row
     max_col = ws.max_column
@@ -462,9 +2351,7 @@ def process_file_phase4(file_path, output_path):
             print(f"デバッグ: data[1] content: {data[1][:5] if isinstance(data[1], list) else data[1]}")  # 最初の5要素のみ
     
     # ② 結合セルの解除：各結合範囲について、上位セルの値で全セルを埋める
-    for merged_range in ws.merged_cells.ranges:
-        r1, r2 = merged_range.min_row, merged_range.max_row
-        c1, c2 = merged_range.min_col, merged_range.max_col
+    for r1, c1, r2, c2 in MergedCellIndex.from_sheet(ws, with_values=False).ranges:
         top_left_value = data[r1 - 1][c1 - 1]
         for r in range(r1, r2 + 1):
             for c in range(c1, c2 + 1):
@@ -533,7 +2420,7 @@ def process_file_phase4(file_path, output_path):
             print(f"警告: {os.path.basename(file_path)} のレコードがリストではありません: {type(record)}")
             continue
     
-    new_wb.save(output_path)
+    save_workbook_with_sidecar(new_wb, output_path)
     print(f"正常終了: {os.path.basename(output_path)} を保存しました。")
 
 def process_phase4():
@@ -619,7 +2506,7 @@ def process_phase5():
         file_path = os.path.join(base_dir, file)
         try:
             # Phase4で正規化済みのファイルを直接読み込み
-            df = pd.read_excel(file_path)
+            df = read_excel_with_sidecar(file_path)
             
             if master_headers is None:
                 # 最初のファイルのヘッダーをマスターとして採用
@@ -693,7 +2580,8 @@ def process_phase7():
 def main():
     process_phase1(TARGET_PATH, MUNICIPALITY_NAME, PHASE1_OUTPUT_DIR, LOG_FILE_PATH)
     process_phase2(MUNICIPALITY_NAME, PHASE1_OUTPUT_DIR, PHASE2_OUTPUT_DIR)
-    process_phase3()
+    # Phase4 は値と結合範囲しか使わないため、続けて実行する場合はスタイルを転置しない
+    process_phase3(values_only=PHASE3_VALUES_ONLY != '0')
     process_phase4()
     process_phase5()
     process_phase7()
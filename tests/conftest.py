@@ -0,0 +1,23 @@
+"""merge.py のテストの共通設定"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# テストでは利用者のキャッシュ・カタログを使わない
+os.environ.setdefault('SHEET_CACHE', '0')
+os.environ.setdefault('PATTERN_CATALOG', '0')
+
+# merge.py は読み込み時に出力先（G:\...）を作るため、作業用のディレクトリで読み込む
+_import_dir = tempfile.mkdtemp(prefix='merge-tests-')
+atexit.register(shutil.rmtree, _import_dir, ignore_errors=True)
+_cwd = os.getcwd()
+os.chdir(_import_dir)
+try:
+    import merge  # noqa: F401,E402
+finally:
+    os.chdir(_cwd)
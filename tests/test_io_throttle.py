@@ -0,0 +1,78 @@
+"""Phase3 の読み込み間隔の調整（IoThrottle）の待ち時間の推移"""
+import pytest
+from openpyxl import Workbook
+
+import merge
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """time.sleep の代わりに待ち時間を記録する"""
+    recorded = []
+    monkeypatch.setattr(merge.time, 'sleep', recorded.append)
+    return recorded
+
+
+def run_reads(throttle, samples):
+    for seconds, error in samples:
+        throttle.wait()
+        throttle.observe(seconds, error)
+
+
+def test_sustained_slow_reads_adapt_baseline(sleeps):
+    # 速い読み込みのあと遅い状態が続いても、基準が追いつけば減速は止まる
+    throttle = merge.IoThrottle(rate=0, max_delay=30, spike_factor=3)
+    run_reads(throttle, [(0.02, None)] + [(1.5, None)] * 20)
+    assert throttle.backoff_count == 1
+    assert sleeps == [1.0, 0.5, 0.25, 0.125, 0.0625]
+    assert throttle.backoff == 0.0
+
+
+def test_single_spike_backs_off_then_recovers(sleeps):
+    throttle = merge.IoThrottle(rate=0, max_delay=30, spike_factor=3)
+    run_reads(throttle, [(0.1, None)] * 10 + [(2.0, None)] + [(0.1, None)] * 6)
+    assert throttle.backoff_count == 1
+    assert sleeps == [1.0, 0.5, 0.25, 0.125, 0.0625]
+
+
+def test_read_errors_double_up_to_max_delay(sleeps):
+    throttle = merge.IoThrottle(rate=0, max_delay=5, spike_factor=3)
+    run_reads(throttle, [(0.1, OSError('busy'))] * 5 + [(0.1, None)] * 2)
+    assert sleeps == [1.0, 2.0, 4.0, 5.0, 5.0, 2.5]
+    assert throttle.backoff_count == 5
+    # 失敗した読み込みの所要時間は基準に加えない
+    assert list(throttle.recent_seconds) == [0.1, 0.1]
+
+
+def test_short_reads_are_never_spikes(sleeps):
+    throttle = merge.IoThrottle(rate=0, max_delay=30, spike_factor=3)
+    run_reads(throttle, [(0.01, None), (0.4, None), (0.01, None)])
+    assert throttle.backoff_count == 0
+    assert sleeps == []
+
+
+class RecordingThrottle(merge.IoThrottle):
+    def __init__(self):
+        super().__init__(rate=0)
+        self.observed = []
+
+    def observe(self, seconds, error=None):
+        self.observed.append(error)
+        super().observe(seconds, error)
+
+
+def test_cache_hits_are_not_observed(tmp_path, monkeypatch):
+    source = tmp_path / 'source.xlsx'
+    wb = Workbook()
+    wb.active.append(['No.', '項目'])
+    wb.active.append([1, '名称'])
+    wb.save(source)
+    monkeypatch.setattr(merge, 'SHEET_CACHE_ENABLED', True)
+    monkeypatch.setattr(merge, '_sheet_cache', merge.SheetCache(str(tmp_path / 'cache'), 1 << 20))
+
+    first = RecordingThrottle()
+    merge.build_pattern_book_phase3('PAT0001', [str(source)], str(tmp_path), throttle=first)
+    assert first.observed == [None]
+    second = RecordingThrottle()
+    merge.build_pattern_book_phase3('PAT0001', [str(source)], str(tmp_path), throttle=second)
+    assert second.observed == []
@@ -0,0 +1,116 @@
+"""軽量な読み込み（read_sheet_values / read_excel_values / read_sheet_source）と load_workbook・pd.read_excel の比較"""
+import os
+import re
+import subprocess
+import sys
+import zipfile
+from datetime import date, datetime, time
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+import merge
+
+
+def _rewrite_sheet_xml(path, rewrite):
+    with zipfile.ZipFile(path) as archive:
+        parts = {name: archive.read(name) for name in archive.namelist()}
+    name = 'xl/worksheets/sheet1.xml'
+    parts[name] = rewrite(parts[name].decode()).encode()
+    with zipfile.ZipFile(path, 'w') as archive:
+        for part_name, data in parts.items():
+            archive.writestr(part_name, data)
+
+
+@pytest.fixture
+def sample_book(tmp_path):
+    """値の種類・数式（計算結果つき）・結合範囲・スタイル・ハイパーリンクを含むブック"""
+    path = str(tmp_path / 'sample.xlsx')
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['返礼品コード', '商品名', '価格', '登録日', '時刻', '在庫'])
+    ws.append(['A-001', '  みかん ', 1200, datetime(2024, 1, 2, 3, 4), time(1, 2), True])
+    ws.append(['A-002', 'NA', 2.5, date(2023, 5, 6), None, False])
+    ws['D3'].number_format = 'yyyy/mm/dd'
+    ws['A4'] = '=SUM(C2:C3)'
+    ws['B4'] = '="a"&"b"'
+    ws['A1'].font = Font(bold=True)
+    ws['B1'].fill = PatternFill('solid', fgColor='FFFF00')
+    ws['C2'].alignment = Alignment(horizontal='center')
+    ws['D1'].border = Border(left=Side('thin'), bottom=Side('thick'))
+    ws.merge_cells('D1:E2')
+    ws.merge_cells('A6:B7')
+    ws['F6'].hyperlink = 'http://example.com'
+    ws['H10'].font = Font(italic=True)
+    wb.save(path)
+
+    def rewrite(xml):
+        # 数式の計算結果を入れ、値の無いセルにハイパーリンクを付ける（Excel で保存したブックと同じ形）
+        xml = xml.replace('<f>SUM(C2:C3)</f><v />', '<f>SUM(C2:C3)</f><v>1202.5</v>')
+        xml = re.sub(r'<c r="F6"[^>]*>.*?</c>', '', xml)
+        return xml.replace('<hyperlinks>', '<hyperlinks><hyperlink ref="C8" location="Sheet!A1" />')
+    _rewrite_sheet_xml(path, rewrite)
+    return path
+
+
+def grid_signature(grid, with_styles=False):
+    signature = (grid.max_row, grid.max_column, [list(row) for row in grid.values], sorted(grid.merged_refs))
+    if with_styles:
+        signature += ([[None if index < 0 else grid.styles[index] for index in row] for row in grid.style_ids],)
+    return signature
+
+
+def worksheet_signature(path, data_only, with_styles=False):
+    ws = load_workbook(path, data_only=data_only).active
+    return grid_signature(merge.SheetGrid.from_worksheet(ws, with_styles=with_styles), with_styles)
+
+
+@pytest.mark.parametrize('data_only', [True, False])
+def test_read_sheet_values_matches_load_workbook(sample_book, data_only):
+    assert grid_signature(merge.read_sheet_values(sample_book, data_only=data_only)) \
+        == worksheet_signature(sample_book, data_only)
+
+
+def test_empty_linked_cell_takes_link_target(sample_book):
+    grid = merge.read_sheet_values(sample_book)
+    assert grid.cell(6, 6).value == 'http://example.com'
+    assert grid.cell(8, 3).value == 'Sheet!A1'
+
+
+def test_read_excel_values_matches_read_excel(sample_book):
+    pd.testing.assert_frame_equal(merge.read_excel_values(sample_book), pd.read_excel(sample_book))
+
+
+@pytest.mark.parametrize('data_only', [True, False])
+@pytest.mark.parametrize('with_styles', [False, True])
+def test_read_sheet_source_views_match_load_workbook(sample_book, data_only, with_styles):
+    grid = merge.read_sheet_source(sample_book).view(data_only=data_only, with_styles=with_styles)
+    assert grid_signature(grid, with_styles) == worksheet_signature(sample_book, data_only, with_styles)
+
+
+def test_read_sheet_source_keeps_cached_value_and_formula(sample_book):
+    source = merge.read_sheet_source(sample_book)
+    assert source.view(data_only=True).cell(4, 1).value == 1202.5
+    assert source.view(data_only=False).cell(4, 1).value == '=SUM(C2:C3)'
+
+
+def test_fallback_without_internal_api_matches(sample_book, monkeypatch):
+    monkeypatch.setattr(merge, 'LIGHT_READER_AVAILABLE', False)
+    for data_only in (True, False):
+        assert grid_signature(merge.read_sheet_values(sample_book, data_only=data_only)) \
+            == worksheet_signature(sample_book, data_only)
+        assert grid_signature(merge.read_sheet_source(sample_book).view(data_only=data_only, with_styles=True), True) \
+            == worksheet_signature(sample_book, data_only, with_styles=True)
+    pd.testing.assert_frame_equal(merge.read_excel_values(sample_book), pd.read_excel(sample_book))
+
+
+def test_import_without_internal_api(tmp_path):
+    # 内部 API が無い openpyxl でも merge.py を読み込め、軽量な読み込みが無効になる
+    code = ("import openpyxl.worksheet._reader as reader; del reader._cast_number; "
+            "import merge; print(merge.LIGHT_READER_AVAILABLE)")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
@@ -0,0 +1,80 @@
+"""似たパターンのクラスタリング（cluster_near_duplicate_patterns）と総当たりの比較"""
+import random
+
+import pytest
+
+import merge
+
+VOCABULARY = [f'項目{k}' for k in range(40)]
+
+
+def random_patterns(rng, count):
+    base_layouts = [rng.sample(VOCABULARY, rng.randint(4, 12)) for _ in range(4)]
+    patterns = {}
+    for n in range(count):
+        values = list(rng.choice(base_layouts))
+        for _ in range(rng.randint(0, 3)):
+            if values and rng.random() < 0.5:
+                values.pop(rng.randrange(len(values)))
+            else:
+                values.append(rng.choice(VOCABULARY))
+        if rng.random() < 0.1:
+            values = [f'　{value} ' for value in values]  # 全角空白などの表記ゆれ
+        patterns[f'PAT{n + 1:04d}'] = values
+    return patterns
+
+
+def brute_force_clusters(patterns, threshold, candidate):
+    """candidate(a, b) が真のペアを総当たりで Jaccard 類似度を確かめてまとめる"""
+    names = list(patterns)
+    tokens = [merge.layout_tokens(patterns[name]) for name in names]
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(names)):
+        for j in range(i):
+            if tokens[i] and tokens[j] and candidate(i, j) \
+                    and len(tokens[i] & tokens[j]) / len(tokens[i] | tokens[j]) >= threshold:
+                root_a, root_b = find(i), find(j)
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+    return {name: names[find(i)] for i, name in enumerate(names)}
+
+
+def shares_bucket(patterns):
+    signatures = [merge.minhash_signature(merge.layout_tokens(values)) for values in patterns.values()]
+
+    def bands(signature):
+        return {(band, signature[band * merge.MINHASH_ROWS:(band + 1) * merge.MINHASH_ROWS].tobytes())
+                for band in range(merge.MINHASH_BANDS)}
+    band_sets = [bands(signature) if signature is not None else set() for signature in signatures]
+    return lambda i, j: bool(band_sets[i] & band_sets[j])
+
+
+@pytest.mark.parametrize('seed', range(15))
+def test_clusters_match_brute_force_over_bucket_pairs(seed):
+    # 同じバケットに入ったペアは、類似度が閾値以上なら必ず同じクラスタになる
+    patterns = random_patterns(random.Random(seed), 40)
+    expected = brute_force_clusters(patterns, 0.7, shares_bucket(patterns))
+    assert merge.cluster_near_duplicate_patterns(patterns, threshold=0.7) == expected
+
+
+def test_highly_similar_pairs_are_clustered():
+    patterns = random_patterns(random.Random(99), 60)
+    clusters = merge.cluster_near_duplicate_patterns(patterns, threshold=0.7)
+    names = list(patterns)
+    for i, a in enumerate(names):
+        for b in names[:i]:
+            tokens_a, tokens_b = merge.layout_tokens(patterns[a]), merge.layout_tokens(patterns[b])
+            if tokens_a and tokens_b and len(tokens_a & tokens_b) / len(tokens_a | tokens_b) >= 0.9:
+                assert clusters[a] == clusters[b]
+
+
+def test_representative_is_first_registered():
+    patterns = {'PAT0001': ['a', 'b', 'c', 'd'], 'PAT0002': ['x'], 'PAT0003': ['a', 'b', 'c', 'd', 'e'],
+                'PAT0004': []}
+    assert merge.cluster_near_duplicate_patterns(patterns, threshold=0.7) == {
+        'PAT0001': 'PAT0001', 'PAT0002': 'PAT0002', 'PAT0003': 'PAT0001', 'PAT0004': 'PAT0004'}
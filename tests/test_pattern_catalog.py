@@ -0,0 +1,50 @@
+"""自治体をまたいだパターンカタログ（PatternCatalog）"""
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import Workbook
+
+import merge
+
+
+def test_register_returns_known_pattern(tmp_path):
+    catalog = merge.PatternCatalog(str(tmp_path / 'catalog.sqlite'))
+    values = ['事業者名', '商品名', 1, datetime(2024, 1, 2)]
+    catalog_id, known = catalog.register(values, 'B2', '熊本市', 'PAT0001')
+    assert known is None
+    assert catalog.resolve(values) == (catalog_id, '熊本市', 'PAT0001')
+    assert catalog.register(values, 'C3', '八代市', 'PAT0004') == (catalog_id, (catalog_id, '熊本市', 'PAT0001'))
+    # 値の型まで一致しなければ別のパターン
+    other_id, known = catalog.register(['事業者名', '商品名', '1', datetime(2024, 1, 2)], 'B2', '八代市', 'PAT0005')
+    assert known is None and other_id != catalog_id
+
+
+def test_record_usage_replaces_municipality_rows(tmp_path):
+    catalog = merge.PatternCatalog(str(tmp_path / 'catalog.sqlite'))
+    first, _ = catalog.register(['a'], 'B2', '熊本市', 'PAT0001')
+    second, _ = catalog.register(['b'], 'B2', '熊本市', 'PAT0002')
+    catalog.record_usage('熊本市', {'PAT0001': first, 'PAT0002': second}, {'PAT0001': 3, 'PAT0002': 1})
+    catalog.record_usage('八代市', {'PAT0001': first}, {'PAT0001': 2})
+    assert catalog.municipalities_using(first) == [('八代市', 'PAT0001'), ('熊本市', 'PAT0001')]
+    catalog.record_usage('熊本市', {'PAT0001': second}, {'PAT0001': 1})
+    assert catalog.municipalities_using(first) == [('八代市', 'PAT0001')]
+    assert catalog.municipalities_using(second) == [('熊本市', 'PAT0001')]
+
+
+def test_phase1_reports_first_municipality(tmp_path, monkeypatch):
+    monkeypatch.setattr(merge, 'PATTERN_CATALOG_ENABLED', True)
+    monkeypatch.setattr(merge, 'PATTERN_CATALOG_PATH', str(tmp_path / 'catalog.sqlite'))
+    for municipality in ('熊本市', '八代市'):
+        folder = tmp_path / municipality / 'A001_alpha'
+        folder.mkdir(parents=True)
+        wb = Workbook()
+        wb.active['B2'] = '返礼品コード'
+        wb.active['B3'] = '商品名'
+        wb.save(folder / 'sheet.xlsx')
+        output_dir = tmp_path / f'{municipality}_out'
+        output_dir.mkdir()
+        merge.process_phase1(str(tmp_path / municipality), municipality, str(output_dir),
+                             str(output_dir / 'log.txt'), incremental=False)
+    counts = pd.read_excel(tmp_path / '八代市_out' / '八代市_パターン別ファイル数.xlsx')
+    assert counts.loc[0, 'カタログID'] == 'CAT000001'
+    assert counts.loc[0, '初出自治体'] == '熊本市'
@@ -0,0 +1,53 @@
+"""Phase1（返礼品コードの探索とパターンの採番）"""
+import json
+
+from openpyxl import Workbook
+
+import merge
+
+
+def make_source(path, labels):
+    wb = Workbook()
+    ws = wb.active
+    ws['B2'] = '返礼品コード'
+    for offset, label in enumerate(labels, start=3):
+        ws.cell(offset, 2, label)
+        ws.cell(offset, 3, f'{label}の値')
+    wb.save(path)
+
+
+def run_phase1(tmp_path, monkeypatch, **kwargs):
+    monkeypatch.setattr(merge, 'PATTERN_CATALOG_ENABLED', False)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir(exist_ok=True)
+    merge.process_phase1(str(tmp_path / 'target'), 'M', str(output_dir), str(output_dir / 'log.txt'),
+                         incremental=True, **kwargs)
+    with open(output_dir / 'M_manifest.json', encoding='utf-8') as f:
+        return {entry['path']: entry for entry in json.load(f)['files']}
+
+
+def test_failed_logging_does_not_shift_scan_results(tmp_path, monkeypatch):
+    # 表示やログの書き込みで失敗しても、後のファイルに前のファイルの結果が割り当てられない
+    folder = tmp_path / 'target' / 'A001_alpha'
+    folder.mkdir(parents=True)
+    sources = {'f0_a.xlsx': ['事業者名', '商品名'], 'f1_b.xlsx': ['事業者名', '価格'],
+               'f2_c.xlsx': ['商品名', '内容量', '価格']}
+    for name, labels in sources.items():
+        make_source(folder / name, labels)
+
+    failed = []
+
+    def console_print(*args, **kwargs):
+        # 最初に処理するファイルの表示だけ失敗させる
+        if not failed and str(args[0]).startswith('Processing file: '):
+            failed.append(str(args[0])[len('Processing file: '):])
+            raise UnicodeEncodeError('cp932', '\u2014', 0, 1, 'illegal multibyte sequence')
+    monkeypatch.setattr(merge, 'print', console_print, raising=False)
+
+    manifest = run_phase1(tmp_path, monkeypatch)
+    # 表示に失敗したファイルは記録せず（次回読み直す）、他のファイルは自分の値で記録される
+    assert str(folder / failed[0]) not in manifest
+    for name in set(sources) - set(failed):
+        entry = manifest[str(folder / name)]
+        assert entry['status'] == 'found'
+        assert entry['values'] == sources[name]
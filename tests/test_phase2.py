@@ -0,0 +1,174 @@
+"""Phase2（列単位でまとめた集計）と、行ごとに見出しを集めていた元の処理の比較"""
+import json
+import random
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import merge
+
+CELL_VALUES = ['名称', ' 名称 ', '価格', '価格　', 1, 1.0, 2.5, '', None, 'PAT0001', '返礼品コード',
+               'x', 'y', ' ', True, datetime(2024, 1, 1)]
+
+
+def baseline_phase2(input_file, output_file):
+    """列ごと・行ごとに str(セル).strip() を繰り返していた元の Phase2"""
+    df = pd.read_excel(input_file, sheet_name="Sheet1", header=None).fillna("")
+    data = [row for row in df.values.tolist() if str(row[0]).strip() != ""]
+    last_row = len(data)
+    unique_headers = {}
+    header_order = []
+    for col in range(len(data[0]) - 1, 1, -1):
+        for r in range(1, last_row):
+            cell_value = str(data[r][col]).strip()
+            if cell_value != "" and cell_value not in unique_headers:
+                unique_headers[cell_value] = True
+                header_order.append(cell_value)
+    headers = header_order[::-1]
+    new_data = [[data[0][0], data[0][1]] + headers]
+    for r in range(1, last_row):
+        row_data = {}
+        for cell in data[r]:
+            cell_str = str(cell).strip()
+            if cell_str != "":
+                row_data[cell_str] = cell_str
+        new_data.append([data[r][0], data[r][1]] + [row_data.get(h, "") for h in headers])
+    for i, row in enumerate(new_data):
+        if i == 0 or (isinstance(row[0], str) and row[0].startswith("PAT")):
+            row.insert(2, "返礼品コード")
+        else:
+            row.insert(2, "")
+    col_counts = [(col, sum(1 for row in new_data[1:] if str(row[col]).strip() != ""))
+                  for col in range(len(new_data[0]))]
+    col_counts.sort(key=lambda x: x[1], reverse=True)
+    reordered = [[row[col] for col, _ in col_counts] for row in new_data]
+    pd.DataFrame(reordered).to_excel(output_file, index=False, header=False)
+
+
+def random_pattern_rows(rng, row_count, column_count):
+    rows = [['パターン名', 'A1形式'] + [f'値{k}' for k in range(column_count - 2)]]
+    for r in range(row_count):
+        rows.append([rng.choice([f'PAT{r:04d}', '', ' ', 'X1', 5]), rng.choice(['B4', 'C3', '', None])]
+                    + [rng.choice(CELL_VALUES) for _ in range(column_count - 2)])
+    return rows
+
+
+def sheet_values(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+def run_both(tmp_path, rows, incremental=False):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir(exist_ok=True)
+    pd.DataFrame(rows).to_excel(input_dir / 'M_パターン一覧.xlsx', index=False, header=False)
+    baseline_file = tmp_path / 'baseline.xlsx'
+    baseline_phase2(input_dir / 'M_パターン一覧.xlsx', baseline_file)
+    merge.process_phase2('M', str(input_dir), str(tmp_path), incremental=incremental)
+    return sheet_values(tmp_path / 'M_パターン一覧_Phase2.xlsx'), sheet_values(baseline_file)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_phase2_matches_baseline(tmp_path, seed):
+    rng = random.Random(seed)
+    rows = random_pattern_rows(rng, rng.randint(1, 30), rng.randint(2, 12))
+    got, expected = run_both(tmp_path, rows)
+    assert got == expected
+
+
+
+def test_phase2_long_cell_keeps_memory_small(tmp_path):
+    # 1セルだけ長い場合に、全セルをその長さの固定長文字列にしない
+    rows = random_pattern_rows(random.Random(2), 200, 20)
+    rows[5][7] = ' ' + '長' * 20000 + ' '
+    tracemalloc.start()
+    try:
+        got, expected = run_both(tmp_path, rows)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert got == expected
+    assert peak < 64 << 20
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pattern_header_index_matches_phase2_rows(tmp_path, seed):
+    rng = random.Random(seed)
+    run_both(tmp_path, random_pattern_rows(rng, rng.randint(1, 30), rng.randint(3, 12)))
+    index_path = merge.pattern_header_index_path(str(tmp_path), 'M')
+    index = merge.PatternHeaderIndex.load(index_path)
+
+    # 元の Phase2 と同じ読み方で、各パターン行に現れる値を集める
+    df = pd.read_excel(tmp_path / 'in' / 'M_パターン一覧.xlsx', sheet_name="Sheet1", header=None).fillna("")
+    rows = [[str(cell).strip() for cell in row] for row in df.values.tolist()]
+    rows = [row for row in rows if row[0] != ""][1:]
+    header_order = []
+    for col in range(len(rows[0]) - 1, 1, -1) if rows else []:
+        for row in rows:
+            if row[col] != "" and row[col] not in header_order:
+                header_order.append(row[col])
+    assert index.headers == header_order[::-1]
+    assert index.patterns == [row[0] for row in rows]
+    for i, row in enumerate(rows):
+        if index.patterns.index(row[0]) == i:  # 同名のパターンは先の行を見る
+            assert index.headers_of(row[0]) == [header for header in index.headers if header in row]
+    for header in index.headers:
+        having = [row[0] for row in rows if header in row]
+        assert index.patterns_with(header) == having
+        assert index.fill_count(header) == len(having)
+    assert index.headers_of('存在しないパターン') == []
+    assert index.patterns_with('存在しない見出し') == []
+    assert index.fill_count('存在しない見出し') == 0
+
+    # 保存し直して読み込んでも同じ内容になる
+    copy_path = str(tmp_path / 'copy.npz')
+    index.save(copy_path)
+    loaded = merge.PatternHeaderIndex.load(copy_path)
+    assert (loaded.patterns, loaded.headers) == (index.patterns, index.headers)
+    assert loaded.indptr.tolist() == index.indptr.tolist()
+    assert loaded.indices.tolist() == index.indices.tolist()
+    assert loaded.fill_counts.tolist() == index.fill_counts.tolist()
+
+@pytest.mark.parametrize('seed', range(10))
+def test_incremental_phase2_matches_baseline(tmp_path, seed):
+    rng = random.Random(seed)
+    rows = random_pattern_rows(rng, rng.randint(0, 10), 8)
+    for _ in range(5):
+        change = rng.choice(['append', 'append', 'wide', 'modify', 'none'])
+        if change == 'append':
+            rows += random_pattern_rows(rng, rng.randint(1, 4), rng.randint(3, 8))[1:]
+        elif change == 'wide':
+            rows += random_pattern_rows(rng, 1, rng.randint(9, 12))[1:]
+        elif change == 'modify' and len(rows) > 1:
+            rows[rng.randint(1, len(rows) - 1)][2] = 'changed'
+        got, expected = run_both(tmp_path, rows, incremental=True)
+        assert got == expected
+
+
+def test_unchanged_phase2_skips_writes(tmp_path, capsys):
+    rows = random_pattern_rows(random.Random(0), 10, 6)
+    run_both(tmp_path, rows, incremental=True)
+    output_file = tmp_path / 'M_パターン一覧_Phase2.xlsx'
+    index_file = tmp_path / 'M_pattern_headers.npz'
+    written = (output_file.stat().st_mtime_ns, index_file.stat().st_mtime_ns)
+    capsys.readouterr()
+
+    merge.process_phase2('M', str(tmp_path / 'in'), str(tmp_path), incremental=True)
+    assert '書き込みを省略します' in capsys.readouterr().out
+    assert (output_file.stat().st_mtime_ns, index_file.stat().st_mtime_ns) == written
+
+    # 出力に手を加えた場合は書き直す
+    pd.DataFrame([['edited']]).to_excel(output_file, index=False, header=False)
+    got, expected = run_both(tmp_path, rows, incremental=True)
+    assert got == expected
+
+
+def test_phase2_state_is_json(tmp_path):
+    run_both(tmp_path, random_pattern_rows(random.Random(1), 5, 6), incremental=True)
+    with open(tmp_path / 'M_phase2_state.json', encoding='utf-8') as f:
+        stored = json.load(f)
+    assert stored['version'] == merge.PHASE2_STATE_VERSION
+    # 保存するのは入力・出力の指紋だけ（集計済みの行や見出しは持たない）
+    assert set(stored) == {'version', 'fingerprints'}
@@ -0,0 +1,73 @@
+"""Phase3 の値だけの転置と、スタイル付きの転置の比較（値と結合範囲が同じになること）"""
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+import merge
+
+THIN = Side(style='thin')
+
+
+def make_source(path, labels, item_count, anchor_row, variant):
+    wb = Workbook()
+    ws = wb.active
+    ws.cell(1, 1, '返礼品シート').font = Font(bold=True, size=14)
+    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=4)
+    ws.cell(anchor_row - 1, 2, '項目')
+    ws.merge_cells(start_row=anchor_row - 1, start_column=2, end_row=anchor_row - 1, end_column=3)
+    ws.cell(anchor_row, 2, '返礼品コード').fill = PatternFill('solid', fgColor='FFFF00')
+    row = anchor_row + 1
+    for label in labels:
+        cell = ws.cell(row, 2, label)
+        cell.border = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+        cell.alignment = Alignment(wrap_text=True)
+        for k in range(item_count):
+            value = 1000 * (k + 1) if label == '価格' else f'{label}_{k}_{variant}'
+            item = ws.cell(row, 4 + k, value)
+            if k % 2:
+                item.font = Font(italic=True)
+        row += 1
+    ws.merge_cells(start_row=anchor_row + 1, start_column=4, end_row=anchor_row + 2, end_column=4)
+    ws.cell(row + 2, 2, '備考')
+    ws.cell(row + 2, 4, datetime(2025, 9, 9))
+    ws.cell(row + 3, 4, f'=D{anchor_row + 2}&"x"')
+    wb.save(path)
+
+
+@pytest.fixture
+def source_files(tmp_path):
+    layouts = [['事業者名', '商品名', '内容量', '価格'], ['事業者名', '商品名', '説明', '価格', '配送方法'],
+               ['事業者名', '商品名', '価格']]
+    paths = []
+    for i, labels in enumerate(layouts):
+        path = str(tmp_path / f'source_{i}.xlsx')
+        make_source(path, labels, 2 + i, 4 + i % 2, i)
+        paths.append(path)
+    return paths
+
+
+def build(tmp_path, name, file_paths, **kwargs):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    merge.build_pattern_book_phase3('PAT0001', file_paths, str(output_dir), **kwargs)
+    ws = load_workbook(output_dir / 'PAT0001.xlsx').active
+    values = [list(row) for row in ws.iter_rows(values_only=True)]
+    styled = sum(1 for row in ws.iter_rows() for cell in row if cell.has_style)
+    return values, sorted(str(merged_range) for merged_range in ws.merged_cells.ranges), styled
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('sheet_cache', [False, True])
+def test_values_only_matches_styled_values_and_merges(tmp_path, source_files, monkeypatch, streaming, sheet_cache):
+    if sheet_cache:
+        monkeypatch.setattr(merge, 'SHEET_CACHE_ENABLED', True)
+        monkeypatch.setattr(merge, '_sheet_cache', merge.SheetCache(str(tmp_path / 'cache'), 1 << 24))
+    styled_values, styled_merges, styled_cells = build(tmp_path, 'styled', source_files, streaming=streaming)
+    values, merges, values_only_styled = build(tmp_path, 'values', source_files, streaming=streaming,
+                                               values_only=True)
+    assert styled_cells > 0
+    assert values == styled_values
+    assert merges == styled_merges
+    assert values_only_styled < styled_cells
@@ -0,0 +1,131 @@
+"""解析済みシートのキャッシュ（load_active_sheet）"""
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+import merge
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = str(tmp_path / 'book.xlsx')
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['返礼品コード', '商品名'])
+    ws.append(['A-001', '=1+1'])
+    ws['A1'].font = Font(bold=True)
+    ws.merge_cells('C1:D2')
+    wb.save(path)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    sheet_cache = merge.SheetCache(str(tmp_path / 'cache'), 1 << 24)
+    monkeypatch.setattr(merge, 'SHEET_CACHE_ENABLED', True)
+    monkeypatch.setattr(merge, '_sheet_cache', sheet_cache)
+    return sheet_cache
+
+
+def signature(grid, with_styles=False):
+    result = (grid.max_row, grid.max_column, [list(row) for row in grid.values], sorted(grid.merged_refs))
+    if with_styles:
+        result += ([[None if index < 0 else grid.styles[index] for index in row] for row in grid.style_ids],)
+    return result
+
+
+def expected(path, data_only, with_styles=False):
+    ws = load_workbook(path, data_only=data_only).active
+    return signature(merge.SheetGrid.from_worksheet(ws, with_styles=with_styles), with_styles)
+
+
+def forbid(monkeypatch, name):
+    def fail(*args, **kwargs):
+        raise AssertionError(f"{name} は呼ばれないはず")
+    monkeypatch.setattr(merge, name, fail)
+
+
+def test_cache_is_off_by_default(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != 'SHEET_CACHE'}
+    env['PYTHONPATH'] = os.path.dirname(merge.__file__)
+    result = subprocess.run([sys.executable, '-c', 'import merge; print(merge.SHEET_CACHE_ENABLED)'],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
+
+
+@pytest.mark.parametrize('data_only', [True, False])
+@pytest.mark.parametrize('with_styles', [False, True])
+def test_cache_without_light_loader_uses_load_workbook(book, cache, monkeypatch, data_only, with_styles):
+    monkeypatch.setattr(merge, 'LIGHT_XLSX_LOADER', False)
+    forbid(monkeypatch, 'read_sheet_source')
+    forbid(monkeypatch, 'read_sheet_values')
+    for _ in range(2):  # 1回目は読み込み、2回目はキャッシュから
+        grid = merge.load_active_sheet(book, data_only=data_only, with_styles=with_styles)
+        assert signature(grid, with_styles) == expected(book, data_only, with_styles)
+    assert cache.hits == 1
+
+
+def test_cache_light_read_uses_light_reader(book, cache, monkeypatch):
+    forbid(monkeypatch, 'read_sheet_source')
+    forbid(monkeypatch, 'load_workbook')
+    grid = merge.load_active_sheet(book, light=True)
+    assert grid.cell(2, 2).value == '=1+1'
+
+
+def test_cache_with_light_loader_shares_one_entry(book, cache, monkeypatch):
+    monkeypatch.setattr(merge, 'LIGHT_XLSX_LOADER', True)
+    styled = merge.load_active_sheet(book, with_styles=True)
+    assert signature(styled, True) == expected(book, False, True)
+    # スタイル付きで読んだエントリを、値だけの読み込みもそのまま使う
+    forbid(monkeypatch, 'read_sheet_source')
+    forbid(monkeypatch, 'read_sheet_values')
+    assert signature(merge.load_active_sheet(book, data_only=True)) == expected(book, True)
+    assert cache.hits == 1
+
+
+
+def rewrite_member(path, name, old, new):
+    with zipfile.ZipFile(path) as archive:
+        parts = {part: archive.read(part) for part in archive.namelist()}
+    parts[name] = parts[name].replace(old, new)
+    with zipfile.ZipFile(path, 'w') as archive:
+        for part, data in parts.items():
+            archive.writestr(part, data)
+
+
+def test_fingerprint_follows_hyperlink_target(tmp_path, cache):
+    # 空のセルのハイパーリンクは参照先がセルの値になり、参照先はシートの rels にだけ書かれる
+    path = str(tmp_path / 'link.xlsx')
+    wb = Workbook()
+    wb.active['A1'] = '返礼品コード'
+    wb.active['B2'].hyperlink = 'http://example.com/old'
+    wb.save(path)
+    # openpyxl は参照先をセルの値としても書くため、値のない B2 にする
+    rewrite_member(path, 'xl/worksheets/sheet1.xml',
+                   b'<c r="B2" t="inlineStr"><is><t>http://example.com/old</t></is></c>', b'')
+    before = merge.workbook_fingerprint(path)
+    assert merge.load_active_sheet(path, data_only=True).cell(2, 2).value == 'http://example.com/old'
+
+    rewrite_member(path, 'xl/worksheets/_rels/sheet1.xml.rels', b'/old', b'/new')
+    assert merge.workbook_fingerprint(path) != before
+    assert merge.load_active_sheet(path, data_only=True).cell(2, 2).value == 'http://example.com/new'
+    assert cache.hits == 0
+
+
+@pytest.mark.parametrize('data_only', [True, False])
+def test_values_only_miss_does_not_read_styles(book, cache, monkeypatch, data_only):
+    monkeypatch.setattr(merge, 'LIGHT_XLSX_LOADER', True)
+    want = expected(book, data_only)
+    forbid(monkeypatch, 'read_sheet_source')
+    forbid(monkeypatch, 'apply_stylesheet')
+    monkeypatch.setattr('openpyxl.reader.excel.apply_stylesheet', merge.apply_stylesheet)
+    for _ in range(2):  # 1回目は読み込み、2回目はキャッシュから
+        assert signature(merge.load_active_sheet(book, data_only=data_only)) == want
+    assert cache.hits == 1
+    # スタイル付きのエントリは作らない
+    assert cache.get(merge.workbook_fingerprint(book), merge.SHEET_CACHE_VARIANT) is None
@@ -0,0 +1,75 @@
+"""サイドカー（出力 xlsx と一緒に保存する値）と、xlsx を読み直した結果の比較"""
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+import merge
+
+
+def grid_signature(grid):
+    return (grid.max_row, grid.max_column, [[repr(value) for value in row] for row in grid.values],
+            sorted(grid.merged_refs))
+
+
+@pytest.fixture
+def saved_book(tmp_path):
+    path = str(tmp_path / 'phase.xlsx')
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['パターン名', '返礼品コード', '価格', '登録日', '時刻', '経過', '在庫', '数式'])
+    ws.append(['PAT0001', ' A-001 ', 1200, datetime(2024, 1, 2, 3, 4, 5, 123456), time(1, 2, 3),
+               timedelta(hours=30), True, '=1+1'])
+    ws.append(['PAT0002', 'NA', 0.1 + 0.2, date(2023, 5, 6), None, None, False, 12345678901234567])
+    ws['C3'].number_format = '0.00'
+    ws['A1'].font = Font(bold=True)
+    ws.merge_cells('B5:C6')
+    ws.cell(9, 10).font = Font(italic=True)
+    merge.save_workbook_with_sidecar(wb, path)
+    return path
+
+
+def test_sidecar_grid_matches_reread(saved_book):
+    grid = merge.load_sidecar_grid(saved_book)
+    assert grid is not None
+    expected = merge.SheetGrid.from_worksheet(load_workbook(saved_book, data_only=True).active)
+    assert grid_signature(grid) == grid_signature(expected)
+
+
+@pytest.mark.parametrize('header', [0, None])
+def test_read_excel_with_sidecar_matches_read_excel(saved_book, header):
+    pd.testing.assert_frame_equal(merge.read_excel_with_sidecar(saved_book, header=header),
+                                  pd.read_excel(saved_book, header=header))
+
+
+def test_dataframe_sidecar_matches_read_excel(tmp_path):
+    path = str(tmp_path / 'frame.xlsx')
+    df = pd.DataFrame([['PAT0001', 'B4', '名称', 1.5], ['PAT0002', '', '価格', 2]])
+    merge.write_excel_with_sidecar(df, path, index=False, header=False)
+    assert merge.load_sidecar_grid(path) is not None
+    pd.testing.assert_frame_equal(merge.read_excel_with_sidecar(path, header=None),
+                                  pd.read_excel(path, header=None))
+
+
+def test_sidecar_is_json(saved_book):
+    with open(merge.sidecar_path(saved_book), 'rb') as f:
+        payload = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+    assert payload['version'] == merge.SIDECAR_VERSION
+
+
+def test_edited_workbook_ignores_sidecar(saved_book):
+    wb = load_workbook(saved_book)
+    wb.active['A2'] = 'PAT9999'
+    wb.save(saved_book)
+    assert merge.load_sidecar_grid(saved_book) is None
+    assert merge.read_excel_with_sidecar(saved_book).iloc[0, 0] == 'PAT9999'
+
+
+def test_unreadable_sidecar_is_ignored(saved_book):
+    with open(merge.sidecar_path(saved_book), 'wb') as f:
+        f.write(zlib.compress(b'\x80\x04not json'))
+    assert merge.load_sidecar_grid(saved_book) is None